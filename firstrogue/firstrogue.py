@@ -3,6 +3,17 @@ import math
 import textwrap
 import shelve
 import random
+import re
+import heapq
+import struct
+import sys
+import os
+import time
+import threading
+import zlib
+import ctypes
+from array import array
+from collections import OrderedDict, deque
 
 #sets window size
 SCREEN_WIDTH = 80
@@ -52,6 +63,47 @@ color_dark_ground = libtcod.Color(60,60,60)
 color_nolight_ground = libtcod.Color(20,20,20)
 color_not_in_view_ground = libtcod.Color(10,10,20)
 color_light_ground = libtcod.Color(210,210,67)
+#how many distance fields (sound sources, alert targets) are kept around for reuse
+DISTANCE_FIELD_CACHE_SIZE = 8
+#size of the square buckets monsters are filed in for range queries
+MONSTER_BUCKET_SIZE = 8
+#how far a pathing monster's goal can wander before its A* path is worked out again
+PATH_REPATH_DISTANCE = 3
+#how many turns the player's scent lingers on a tile
+SCENT_DURATION = 40
+#monsters this close to the player are woken up, and awake ones with nothing to do fall asleep past the sleep radius
+WAKE_RADIUS = 20
+SLEEP_RADIUS = 26
+#most turns of wandering a monster makes up for when it wakes
+CATCH_UP_TURNS = 5
+#a turn is split into ticks so monsters can act more or less often than the player. A speed of NORMAL_SPEED acts once a turn
+TURN_TICKS = 12
+NORMAL_SPEED = 100
+#the stat bonuses a piece of equipment can give
+EQUIPMENT_BONUSES = ('power_bonus', 'defense_bonus', 'max_hp_bonus', 'critical_bonus', 'hit_bonus')
+#the eight steps to a neighboring tile, straight ones first
+NEIGHBORS = ((0, -1), (1, 0), (0, 1), (-1, 0), (-1, -1), (1, -1), (1, 1), (-1, 1))
+#matches a run of open tiles in a packed map layer
+OPEN_RUN = re.compile('\x00+')
+#matches a run of the same byte, for run-length encoding map layers in the save file
+SAME_RUN = re.compile(r'(.)\1*', re.DOTALL)
+#save files
+SAVE_FILE = 'savegame.sav'
+SHELVE_FILE = 'benchmark.shelve'  #the old shelve save, only written by the benchmark now. Kept apart from the save files
+SHELVE_EXTENSIONS = ('', '.db', '.dat', '.dir', '.bak', '.pag')    #the files the dbm modules shelve can use make out of SHELVE_FILE
+BENCHMARK_FILES = ('benchmark.sav', 'benchmark.jnl', 'benchmark.lvl')  #SAVE_FILE, JOURNAL_FILE and LEVEL_FILE while the benchmark runs
+SAVE_MAGIC = 'FRSV'
+SAVE_VERSION = 1
+#autosave journal, appended to every turn and folded into a fresh save once it holds more than the save file does
+JOURNAL_FILE = 'savegame.jnl'
+JOURNAL_MAGIC = 'FRJN'
+JOURNAL_CHANGED = 0     #a journal entry holding an object's whole record
+JOURNAL_MOVED = 1       #a journal entry holding only an object's new position
+JOURNAL_POSITION_SIZE = struct.calcsize('<hh')    #the x and y an object record starts with
+#levels the player has left. The ones within RESIDENT_LEVELS of the player's level stay in memory, the rest are paged out to LEVEL_FILE
+LEVEL_FILE = 'savegame.lvl'
+LEVEL_MAGIC = 'FRLV'
+RESIDENT_LEVELS = 1
 #FOV Settings
 FOV_ALGO = 0 #default algorithm
 FOV_LIGHT_WALLS = True
@@ -70,14 +122,53 @@ FIREBALL_DAMAGE = 25
 #   Object System
 #|||||||||||||||||||||||
 
-class Tile:     #a tile of the map and it's properties
-    def __init__(self, blocked, block_sight = None):
-        self.blocked = blocked
-        self.explored = False
-        
+class TileMap:  #the tiles of the map, stored as packed byte layers (one byte per tile, row by row) instead of a Tile object per tile
+    def __init__(self, width, height, blocked=True):
+        self.width = width
+        self.height = height
+        fill = 1 if blocked else 0
+        self.blocked = array('B', [fill]) * (width * height)
         #by default, if a tile is blocked, it also blocks los
+        self.block_sight = array('B', [fill]) * (width * height)
+        self.explored = array('B', [0]) * (width * height)
+        
+    def is_blocked(self, x, y):
+        return self.blocked[y * self.width + x]
+        
+    def blocks_sight(self, x, y):
+        return self.block_sight[y * self.width + x]
+        
+    def is_explored(self, x, y):
+        return self.explored[y * self.width + x]
+        
+    def set_explored(self, x, y):
+        index = y * self.width + x
+        if not self.explored[index]:
+            self.explored[index] = 1
+            journal_tiles.append(index)     #newly explored tiles go in the autosave journal
+        
+    def set_tile(self, x, y, blocked, block_sight=None):
         if block_sight is None: block_sight = blocked
-        self.block_sight = block_sight
+        i = y * self.width + x
+        self.blocked[i] = 1 if blocked else 0
+        self.block_sight[i] = 1 if block_sight else 0
+        
+    def carve_row(self, x1, x2, y):   #makes tiles x1 up to (not including) x2 on row y passable, a whole slice at a time
+        if x2 <= x1: return
+        start = y * self.width + x1
+        end = y * self.width + x2
+        self.blocked[start:end] = array('B', [0]) * (x2 - x1)
+        self.block_sight[start:end] = array('B', [0]) * (x2 - x1)
+        
+    def open_tiles(self):   #yields (x, y) for every tile that is walkable or see-through. Solid rock is skipped a whole run at a time
+        for run in OPEN_RUN.finditer(self.blocked.tostring()):
+            for i in range(run.start(), run.end()):
+                yield (i % self.width, i // self.width)
+        #tiles that can be seen through but not walked on
+        for run in OPEN_RUN.finditer(self.block_sight.tostring()):
+            for i in range(run.start(), run.end()):
+                if self.blocked[i]:
+                    yield (i % self.width, i // self.width)
 
 class Rect:     #a rectangle on the map.  used to charcterize a room.
     def __init__(self,x,y,w,h,is_rectangle=True):
@@ -97,37 +188,173 @@ class Rect:     #a rectangle on the map.  used to charcterize a room.
 
 class Timer:    #a timer, never visible to player, counts down by 1 each turn till 0. Then something happens. Then timer destroys itself, unless repeat=True
     def __init__(self, timer_name, number_of_turns, zero_function, attached_to, repeat):
-        global timer_list
-        
         self.number_of_turns = number_of_turns
-        self.counter = number_of_turns
         self.zero_function = zero_function
         self.repeat = repeat
         self.attached_to = attached_to
         self.timer_name = timer_name
+        self.deadline = None    #the global_timer turn the timer goes off on, set once it is scheduled
+        self.entry = None       #id of the timer's live entry in the timer queue, None once destroyed
         
+    def turns_left(self):   #how many turns until the timer reaches 0
+        return max(self.deadline - global_timer, 0)
+        
+    def set_turns_left(self, number_of_turns):  #restarts the countdown from number_of_turns
+        timer_queue.schedule(self, global_timer + number_of_turns)
         
     def destroy(self):    #removes the timer when it is finished
-        global timer_list
+        timer_queue.cancel(self)
+        
+    def fire(self):   #the timer reached 0, runs zero_function
+        entry = self.entry
+        self.zero_function(self.attached_to)    #runs zero function at 0.  Zero function must remove timer if timer is to be removed using timer.destroy()
+        #unless zero_function destroyed or reset it, the timer stays at 0 and goes off again next turn, or counts down again if repeat=True
+        if self.entry == entry:
+            if self.repeat == True:
+                timer_queue.schedule(self, global_timer + self.number_of_turns)
+            else:
+                timer_queue.schedule(self, global_timer + 1)
+        
+class TimerQueue:   #holds every running timer on a min-heap keyed on the turn it goes off, so timers that aren't due cost nothing per turn
+    def __init__(self):
+        self.heap = []      #(deadline, entry id, timer). Entries of destroyed or rescheduled timers are skipped when they come up
+        self.by_owner = {}  #attached_to -> {timer_name: timer}, for finding a particular timer without a search
+        self.entries = 0
+        
+    def add(self, timer):   #starts a new timer, replacing any timer of the same name on the same owner
+        replaced = self.find(timer.attached_to, timer.timer_name)
+        if replaced is not None:
+            replaced.destroy()
+        self.by_owner.setdefault(timer.attached_to, {})[timer.timer_name] = timer
+        self.schedule(timer, global_timer + timer.number_of_turns)
+        
+    def schedule(self, timer, deadline):    #(re)sets the turn a timer goes off on
+        journal_touch(timer.attached_to)
+        self.entries += 1
+        timer.deadline = deadline
+        timer.entry = self.entries
+        heapq.heappush(self.heap, (deadline, self.entries, timer))
+        
+    def find(self, owner, timer_name):  #returns the named timer attached to owner, or None
+        return self.by_owner.get(owner, {}).get(timer_name)
         
-        timer_list.remove(self)
+    def cancel(self, timer):    #stops a timer. Safe to call while timers are going off
+        journal_touch(timer.attached_to)
+        owner_timers = self.by_owner.get(timer.attached_to)
+        if owner_timers is not None and owner_timers.get(timer.timer_name) is timer:
+            del owner_timers[timer.timer_name]
+            if not owner_timers:
+                del self.by_owner[timer.attached_to]
+        timer.entry = None
         
-    def tick(self):   #decreases timer by 1, if at zero, runs zero_function
-        global timer_list
-        if self.counter == 0:
+    def cancel_all(self, owner):    #stops every timer attached to owner
+        journal_touch(owner)
+        for timer in self.by_owner.pop(owner, {}).values():
+            timer.entry = None
             
-            if self.repeat == True:
-                timer = Timer(self.timer_name, self.number_of_turns, self.zero_function, self.attached_to, self.repeat)
-                timer_list.append(timer)
-                
-            self.zero_function(self.attached_to)    #runs zero function at 0.  Zero function must remove timer if timer is to be removed using timer.destroy()
+    def pop_due(self, turn):    #takes the next timer due on or before turn off the queue, or returns None if there isn't one
+        while self.heap and self.heap[0][0] <= turn:
+            (deadline, entry, timer) = heapq.heappop(self.heap)
+            if timer.entry == entry:
+                return timer
+        return None
+        
+class ActorQueue:   #holds the awake monsters on a min-heap keyed on the tick they next act, so only the ones whose time has come are looked at
+    def __init__(self):
+        self.heap = []      #(tick, entry id, actor). Entries of removed or rescheduled actors are skipped when they come up
+        self.by_actor = {}  #actor -> its current entry id
+        self.entries = 0
+        
+    def __contains__(self, actor):
+        return actor in self.by_actor
+        
+    def __len__(self):
+        return len(self.by_actor)
+        
+    def schedule(self, actor, tick):    #(re)sets the tick an actor next acts on
+        self.entries += 1
+        self.by_actor[actor] = self.entries
+        heapq.heappush(self.heap, (tick, self.entries, actor))
+        
+    def remove(self, actor):    #takes an actor out of the queue. Safe to call while actors are acting
+        self.by_actor.pop(actor, None)
+        
+    def pop_due(self, tick):    #takes the next actor due before tick off the queue and returns (its tick, actor), or None if there isn't one
+        while self.heap and self.heap[0][0] < tick:
+            (due, entry, actor) = heapq.heappop(self.heap)
+            if self.by_actor.get(actor) == entry:
+                del self.by_actor[actor]
+                return (due, actor)
+        return None
+        
+class DistanceField:    #walking distance from every tile of the level to one goal tile, worked out by libtcod's dijkstra over fov_map
+    def __init__(self, goal_x, goal_y):
+        self.goal = (goal_x, goal_y)
+        self.dijkstra = libtcod.dijkstra_new(fov_map)
+        libtcod.dijkstra_compute(self.dijkstra, goal_x, goal_y)
+        
+    def distance(self, x, y):   #walking distance from (x, y) to the goal, or None if there is no way there
+        distance = libtcod.dijkstra_get_distance(self.dijkstra, x, y)
+        #depending on the libtcod build, tiles that can't be reached come back negative or as a huge number
+        if distance < 0 or distance >= MAP_WIDTH * MAP_HEIGHT:
+            return None
+        return distance
+        
+    def recompute(self, goal_x, goal_y):    #moves the goal, reusing the libtcod data
+        self.goal = (goal_x, goal_y)
+        libtcod.dijkstra_compute(self.dijkstra, goal_x, goal_y)
+        
+    def step_from(self, x, y):  #returns the (dx, dy) of the best free step from (x, y) towards the goal, or None if there is none
+        here = self.distance(x, y)
+        if here is None:
+            return None
+        best = None
+        crowded = False     #a step downhill is only taken by another object
+        for (dx, dy) in NEIGHBORS:
+            distance = self.distance(x + dx, y + dy)
+            if distance is None or distance >= here + 1:
+                continue
+            if is_blocked(x + dx, y + dy):
+                if distance < here:
+                    crowded = True
+            elif best is None or distance < best[0]:
+                best = (distance, dx, dy)
+        #go downhill, or flow sideways around whoever is in the way
+        if best is not None and (best[0] < here or (crowded and best[0] <= here)):
+            return (best[1], best[2])
+        return None
+        
+    def delete(self):   #frees the libtcod data
+        libtcod.dijkstra_delete(self.dijkstra)
+        
+class ScentMap:     #the trail of scent the player leaves behind, kept as the turn each tile was last stepped on
+    def __init__(self):
+        self.laid = {}          #(x, y) -> turn the player last stood there
+        self.trail = deque()    #(turn, x, y) oldest first, so old scent can be dropped from the front
+        
+    def deposit(self, x, y, turn):  #the player stood on (x, y) this turn
+        self.laid[(x, y)] = turn
+        self.trail.append((turn, x, y))
+        
+    def expire(self, turn):     #drops scent older than SCENT_DURATION, only ever looking at the old end of the trail
+        while self.trail and self.trail[0][0] <= turn - SCENT_DURATION:
+            (laid_turn, x, y) = self.trail.popleft()
+            if self.laid.get((x, y)) == laid_turn:  #unless the player came back over it since
+                del self.laid[(x, y)]
                 
-        else:
-            self.counter -= 1
-            #print(self.timer_name + ':' + str(self.counter))   #prints timer status in console
+    def step_from(self, x, y):  #returns the (dx, dy) of the free neighbor with fresher scent than (x, y), or None if the trail goes cold
+        best = None
+        here = self.laid.get((x, y), -1)
+        for (dx, dy) in NEIGHBORS:
+            laid_turn = self.laid.get((x + dx, y + dy), -1)
+            if laid_turn > here and (best is None or laid_turn > best[0]) and not is_blocked(x + dx, y + dy):
+                best = (laid_turn, dx, dy)
+        if best is None:
+            return None
+        return (best[1], best[2])
         
 class Object:       #this is a generic object (item, monster, etc) that is always drawn to screen
-    def __init__(self, x, y, char, name, color, dungeon_level=0, status='', blocks=False, always_visible=False, alert=None, fighter=None, ai=None, item=None, equipment=None):
+    def __init__(self, x, y, char, name, color, dungeon_level=0, status='', blocks=False, always_visible=False, alert=None, fighter=None, ai=None, item=None, equipment=None, hunger=None):
         self.x = x
         self.y = y
         self.char = char
@@ -157,48 +384,20 @@ class Object:       #this is a generic object (item, monster, etc) that is alway
             #Equipment is an item
             self.item = Item()
             self.item.owner = self
+            
+        self.hunger = hunger
+        if self.hunger:     #let the hunger component know who owns it
+            self.hunger.owner = self
         
     def move (self, dx, dy):
         #check for blocked
         if not is_blocked(self.x + dx, self.y + dy):
-            #move by the given amount
-            self.x += dx
-            self.y += dy
+            #move by the given amount, keeping the occupancy grid in sync
+            grid_move(self, self.x + dx, self.y + dy)
             
-    def moveai (self):
-        #behavior for monster movement when a direct line to the player is not available
-        not_moved = True
-        while not_moved:
-            direction = libtcod.random_get_int(0,1,5)   #pick a random direction
-            if direction == 1:  #north
-                if not is_blocked(self.x, self.y - 1) and (player.distance(self.x, self.y - 1) <= self.distance_to(player)):
-                    self.y -= 1
-                    not_moved = False
-            elif direction == 2:    #east
-                if not is_blocked(self.x + 1, self.y) and (player.distance(self.x + 1, self.y) <= self.distance_to(player)):
-                    self.x += 1
-                    not_moved = False
-            elif direction == 3:    #south
-                if not is_blocked(self.x, self.y + 1) and (player.distance(self.x, self.y + 1) <= self.distance_to(player)):
-                    self.y += 1
-                    not_moved = False
-            elif direction == 4:    #west
-                if not is_blocked(self.x - 1, self.y) and (player.distance(self.x - 1, self.y) <= self.distance_to(player)):
-                    self.x -= 1
-                    not_moved = False
-            else:   #randomly move in some direction if the space is clear, or else wait a turn if it is not.
-                dx = libtcod.random_get_int(0, -1, 1)
-                dy = libtcod.random_get_int(0, -1, 1)
-                if not is_blocked(self.x + dx, self.y):
-                    self.x = self.x + dx
-                if not is_blocked(self.x, self.y + dy):
-                    self.y = self.y + dy
-                not_moved = False
-
-        
     def draw(self):
         #only show if it's visible to the player
-        if libtcod.map_is_in_fov(fov_map, self.x, self.y):
+        if (self.x, self.y) in visible_tiles:
             (x, y) = to_camera_coordinates(self.x, self.y)
             
             if x is not None:
@@ -206,34 +405,47 @@ class Object:       #this is a generic object (item, monster, etc) that is alway
                 libtcod.console_set_default_foreground(con,self.color)
                 libtcod.console_put_char(con,x,y,self.char,libtcod.BKGND_NONE)
     
-    def clear(self):
-        #erase the character that represents the object
-        (x, y) = to_camera_coordinates(self.x, self.y)
-        if x is not None:
-            libtcod.console_put_char(con, x, y, ' ', libtcod.BKGND_NONE)
+    def move_astar(self, target_x, target_y):  #takes one step along this object's A* path to the target. Returns False if there was no way closer
+        path = monster_paths.get(self)
+        if path is None:
+            path = borrow_path()
+            monster_paths[self] = path
+            stale = True
+        elif libtcod.path_is_empty(path):
+            stale = True
+        else:
+            #only work the path out again if the target got away or the way ahead is no good
+            (goal_x, goal_y) = libtcod.path_get_destination(path)
+            (x, y) = libtcod.path_get(path, 0)
+            stale = (max(abs(goal_x - target_x), abs(goal_y - target_y)) > PATH_REPATH_DISTANCE or
+                max(abs(x - self.x), abs(y - self.y)) > 1 or is_blocked(x, y))
+        if stale:
+            if not libtcod.path_compute(path, self.x, self.y, target_x, target_y) or libtcod.path_is_empty(path):
+                return False
+            (x, y) = libtcod.path_get(path, 0)
+            if is_blocked(x, y):    #somebody is standing in the way, wait for them to move
+                return False
+        (x, y) = libtcod.path_walk(path, False)
+        grid_move(self, x, y)
+        return True
+        
+    def wander(self):   #moves to a random neighboring open space, or doesn't move at all
+        direction = libtcod.random_get_int(0,1,5)
+        if direction == 1:
+            self.move(0, -1)
+        if direction == 2:
+            self.move(1, 0)
+        if direction == 3:
+            self.move(0, 1)
+        if direction == 4:
+            self.move(-1, 0)
             
-    def move_towards(self, target_x, target_y):
-        #vector from this object to the target, and distance
-        dx = target_x - self.x
-        dy = target_y - self.y
-        #below is old move_towards code (hangs on walls)
-        #distance = math.sqrt(dx**2 + dy**2)
-        ##normalize vector to length 1, keeping direction, then round
-        ##and convert to integer so movement is restricted to the map
-        #dx = int(round(dx/distance))
-        #dy = int(round(dy/distance))
-        if dx>0:
-            dx = 1
-        if dx<0:
-            dx = -1
-        if dy>0:
-            dy = 1
-        if dy<0:
-            dy = -1
-        if is_blocked(self.x + dx, self.y + dy):
-            self.moveai()
-        self.move(dx, dy)
-
+    def move_along(self, field):   #takes one step towards the goal of a distance field. Returns False if there was no way closer
+        step = field.step_from(self.x, self.y)
+        if step is None:
+            return False
+        self.move(step[0], step[1])
+        return True
         
     def distance_to(self, other):
         #return the distance to another object
@@ -246,6 +458,13 @@ class Object:       #this is a generic object (item, monster, etc) that is alway
         global objects
         objects.remove(self)
         objects.insert(0, self)
+        #also drawn first among the objects sharing its tile
+        tile_objects = object_grid.get((self.x, self.y))
+        if tile_objects and self in tile_objects:
+            tile_objects.remove(self)
+            tile_objects.insert(0, self)
+            mark_tile_dirty(self.x, self.y)
+        journal_restructure()   #journal records keep each object's place from the last save, so a new drawing order needs a fresh one
         
     def distance(self, x, y):
     #return the distance to some coords
@@ -256,27 +475,22 @@ class Object:       #this is a generic object (item, monster, etc) that is alway
 class Fighter:      #combat-related properties and methods (monsters, player, anything that fights)
     @property
     def power(self):
-        bonus = sum(equipment.power_bonus for equipment in get_all_equipped(self.owner))
-        return self.base_power + bonus
+        return self.base_power + self.bonus('power_bonus')
     @property
-    def defense(self):  #return actual defense, by summing bonuses
-        bonus = sum(equipment.defense_bonus for equipment in get_all_equipped(self.owner))
-        return self.base_defense + bonus
+    def defense(self):  #return actual defense, by adding bonuses
+        return self.base_defense + self.bonus('defense_bonus')
     @property
     def max_hp(self):
-        bonus = sum(equipment.max_hp_bonus for equipment in get_all_equipped(self.owner))
-        return self.base_max_hp + bonus
+        return self.base_max_hp + self.bonus('max_hp_bonus')
     @property
     def critical(self):
-        bonus = sum(equipment.critical_bonus for equipment in get_all_equipped(self.owner))
-        return self.base_critical + bonus
+        return self.base_critical + self.bonus('critical_bonus')
     @property 
     def hit_chance(self):
-        bonus = sum(equipment.hit_bonus for equipment in get_all_equipped(self.owner))
-        return self.base_hit_chance + bonus
+        return self.base_hit_chance + self.bonus('hit_bonus')
         
     
-    def __init__(self, hp, defense, power, critical, xp, hit_chance=ENEMY_HIT_CHANCE, death_function=None):
+    def __init__(self, hp, defense, power, critical, xp, hit_chance=ENEMY_HIT_CHANCE, speed=NORMAL_SPEED, death_function=None):
         self.death_function = death_function
         self.base_max_hp = hp
         self.hp = hp
@@ -285,11 +499,29 @@ class Fighter:      #combat-related properties and methods (monsters, player, an
         self.base_critical = critical
         self.xp = xp
         self.base_hit_chance = hit_chance
+        self.speed = speed
+        self.slots = {}         #slot name -> Equipment worn there
+        self.bonuses = None     #equipment bonus totals, summed when first needed
+        
+    def bonus(self, stat):  #the total bonus everything equipped gives to a stat, kept until the equipment changes
+        if self.bonuses is None:
+            self.bonuses = dict.fromkeys(EQUIPMENT_BONUSES, 0)
+            for equipment in get_all_equipped(self.owner):
+                for name in EQUIPMENT_BONUSES:
+                    self.bonuses[name] += getattr(equipment, name)
+        return self.bonuses[stat]
+        
+    def equipment_changed(self):    #throws away the bonus totals, after something was equipped or removed
+        self.bonuses = None
+        
+    def action_ticks(self):     #how many ticks pass between this fighter's actions
+        return TURN_TICKS * NORMAL_SPEED // self.speed
         
     def take_damage(self,damage):
         #apply damage if possible
         if damage > 0:
             self.hp -= damage
+            journal_touch(self.owner)
         #check for death, if there is a death function call it
         if self.hp <= 0:
             function = self.death_function
@@ -343,22 +575,90 @@ class Fighter:      #combat-related properties and methods (monsters, player, an
         if self.hp > self.max_hp:
             self.hp = self.max_hp
             
+class Inventory:    #an ordered collection of carried objects, where any object can be moved to the front or back or taken out without a search
+    def __init__(self, capacity=26):
+        self.capacity = capacity
+        #a ring of [previous, next, object] nodes around an empty root node
+        self.root = []
+        self.root[:] = [self.root, self.root, None]
+        self.nodes = {}     #object -> its node
+        
+    def __len__(self):
+        return len(self.nodes)
+        
+    def __contains__(self, obj):
+        return obj in self.nodes
+        
+    def __iter__(self):     #front to back
+        node = self.root[1]
+        while node is not self.root:
+            yield node[2]
+            node = node[1]
+            
+    def __getitem__(self, index):   #the object at a position, counting from the front
+        for i, obj in enumerate(self):
+            if i == index:
+                return obj
+        raise IndexError(index)
+        
+    def is_full(self):
+        return len(self.nodes) >= self.capacity
+        
+    def link(self, node, before):   #puts a node in the ring just ahead of another
+        node[0] = before[0]
+        node[1] = before
+        before[0][1] = node
+        before[0] = node
+        
+    def unlink(self, node):     #takes a node out of the ring
+        node[0][1] = node[1]
+        node[1][0] = node[0]
+        
+    def append(self, obj):  #adds an object at the back
+        journal_restructure()
+        node = [None, None, obj]
+        self.nodes[obj] = node
+        self.link(node, self.root)
+        if obj.item:
+            obj.item.container = self
+            
+    def remove(self, obj):
+        journal_restructure()
+        self.unlink(self.nodes.pop(obj))
+        if obj.item:
+            obj.item.container = None
+            
+    def move_to_front(self, obj):
+        journal_restructure()
+        node = self.nodes[obj]
+        self.unlink(node)
+        self.link(node, self.root[1])
+        
+    def move_to_back(self, obj):
+        journal_restructure()
+        node = self.nodes[obj]
+        self.unlink(node)
+        self.link(node, self.root)
+        
 class Item:     #an item that can be picked up and used.
     global master_objects
-    def __init__(self, use_function=None):
+    def __init__(self, use_function=None, contents=None):
         self.use_function = use_function
+        self.contents = contents    #an Inventory, if this item is a bag that holds other items
+        self.container = None       #the Inventory this item is carried in
     def pick_up(self):
         #add to the player's inventory and remove from the map
-        if len(inventory) >= 26:
+        if inventory.is_full():
             message('Your inventory is full, you cannot carry ' + self.owner.name + '!', libtcod.yellow)
         else:
             inventory.append(self.owner)
             objects.remove(self.owner)
+            grid_remove(self.owner)
             master_objects.remove(self.owner)
             message('You picked up a ' + self.owner.name + '!', libtcod.sky)
         #special case: automatically equip, if slot is open
             equipment = self.owner.equipment
-            if equipment and get_equipped_in_slot(equipment.slot) is None:
+            if equipment and get_equipped_in_slot(player, equipment.slot) is None:
                 equipment.equip()
         
     def use(self):
@@ -366,25 +666,33 @@ class Item:     #an item that can be picked up and used.
         if self.owner.equipment:
             self.owner.equipment.toggle_equip()
             return
+        #special case: a bag opens up its own inventory screen
+        if self.contents is not None:
+            chosen_item = inventory_menu('The ' + self.owner.name + ' holds:', self.contents)
+            if chosen_item is not None:
+                chosen_item.use()
+            return
         #just call the "use function" if it is defined
         if self.use_function is None:
             message('The ' + self.owner.name + ' cannot be used.')
         else:
             if self.use_function() != 'cancelled':
-                inventory.remove(self.owner)    #destroy after use, unless cancelled
+                self.container.remove(self.owner)   #destroy after use, unless cancelled
             
     def drop(self):
+        #special case: if it's equipment, de-equip it while it is still in the inventory
+        if self.owner.equipment:
+            self.owner.equipment.dequip()
         #add to the map and remove from inventory, placing at players coords
         objects.append(self.owner)
         master_objects.append(self.owner)
-        inventory.remove(self.owner)
+        self.container.remove(self.owner)
         self.owner.x = player.x
         self.owner.y = player.y
+        self.owner.dungeon_level = dungeon_level
+        grid_add(self.owner)
         self.owner.send_to_back()
         message('You dropped a ' + self.owner.name + '.', libtcod.yellow)
-    #special case: if it's equipment, de-equip it
-        if self.owner.equipment:
-            self.owner.equipment.dequip()
         
 class Equipment:        #an object that can be equipped, yeilding bonuses. Automatically adds the item component
     def __init__(self, slot, power_bonus=0, defense_bonus=0, max_hp_bonus=0, critical_bonus=0, hit_bonus=0):
@@ -395,6 +703,7 @@ class Equipment:        #an object that can be equipped, yeilding bonuses. Autom
         self.critical_bonus = critical_bonus
         self.hit_bonus = hit_bonus
         self.is_equipped = False
+        self.wearer = None      #the object wearing it, while equipped
         
     def toggle_equip(self): #toggle equip/deequip status
         if self.is_equipped:
@@ -402,39 +711,78 @@ class Equipment:        #an object that can be equipped, yeilding bonuses. Autom
         else:
             self.equip()
             
-    def equip(self):
+    def equip(self, wearer=None):   #puts it on wearer (the player, unless told otherwise)
+        if wearer is None:
+            wearer = player
         #if the slot is already being used, de-equip whatever is there first
-        old_equipment = get_equipped_in_slot(self.slot)
+        old_equipment = get_equipped_in_slot(wearer, self.slot)
         if old_equipment is not None:
             old_equipment.dequip()
-        #equip object and show a message about it
         self.is_equipped = True
-        inventory.remove(self.owner)
-        inventory.insert(0, self.owner)
-        message('Equipped ' + self.owner.name + ' on ' + self.slot + '.', libtcod.blue)
+        self.wearer = wearer
+        journal_restructure()
+        wearer.fighter.slots[self.slot] = self
+        wearer.fighter.equipment_changed()
+        #equipped items move to the top of the player's inventory, and a message is shown
+        if wearer == player:
+            self.owner.item.container.move_to_front(self.owner)
+            message('Equipped ' + self.owner.name + ' on ' + self.slot + '.', libtcod.blue)
         
         
     def dequip(self):
         #deequip object and show a message about it
         if not self.is_equipped: return
+        wearer = self.wearer
         self.is_equipped = False
-        inventory.remove(self.owner)
-        inventory.append(self.owner)
-        message('Removed ' + self.owner.name + ' from ' + self.slot + '.', libtcod.blue)
+        self.wearer = None
+        journal_restructure()
+        del wearer.fighter.slots[self.slot]
+        wearer.fighter.equipment_changed()
+        if wearer == player:
+            self.owner.item.container.move_to_back(self.owner)
+            message('Removed ' + self.owner.name + ' from ' + self.slot + '.', libtcod.blue)
+        
+class Hunger:       #a hunger meter that empties by 1 each turn. When empty, its owner starves until fed
+    def __init__(self, max_turns=HUNGER_AMOUNT):
+        self.max_turns = max_turns
+        self.timer = None
+        
+    def start(self, turns_left=None):   #starts the hunger timer, full unless told how much is left (loading a game)
+        self.timer = Timer('hunger_timer', self.max_turns, starve, self.owner, False)
+        timer_queue.add(self.timer)
+        if turns_left is not None:
+            self.timer.set_turns_left(turns_left)
+            
+    def turns_left(self):   #turns left until starving
+        return self.timer.turns_left()
+        
+    def feed(self, amount): #refills the meter by amount, up to full
+        self.timer.set_turns_left(min(self.turns_left() + amount, self.max_turns))
         
 #@@@@@@@@@  Monster AI routines
 
 class BasicMonster:     #AI for a basic monster, moves toward player and engages in melee when in sight
-    global timer_list
+    def __init__(self, pathing=False):
+        self.pathing = pathing  #pathing monsters find their own way with A*, the rest follow the shared distance fields
+        
+    def chase(self, goal_x, goal_y):    #takes one step toward the goal. Returns False if the monster couldn't get any closer
+        monster = self.owner
+        if self.pathing:
+            return monster.move_astar(goal_x, goal_y)
+        if (goal_x, goal_y) == (player.x, player.y):
+            return monster.move_along(player_distance_field())
+        #every monster heading to the same alert shares one distance field
+        return monster.move_along(distance_field(goal_x, goal_y))
+        
     def take_turn(self):
         # a basic monster takes its turn. Will move toward player and engage in melee.  If player isn't around, moves randomly.
         monster = self.owner
         
         if libtcod.map_is_in_fov(fov_map, monster.x, monster.y):    #if you see monster, it sees you.
-            monster.alert = (player.x, player.y)   #once a monster sees you, if it loses sight, the monster moves toward last known location
+            set_alert(monster, (player.x, player.y))   #once a monster sees you, if it loses sight, the monster moves toward last known location
             #move toward the player if far away
             if monster.distance_to(player) >= 2:
-                monster.move_towards(player.x, player.y)
+                self.chase(player.x, player.y)
             #close enough, attack! (if the player is alive)
             elif player.fighter.hp > 0:
                 monster.fighter.attack(player)
@@ -446,22 +794,19 @@ class BasicMonster:     #AI for a basic monster, moves toward player and engages
         elif monster.alert != None: #if monster is alerted, move toward location of the alert
             alert_x = monster.alert[0]
             alert_y = monster.alert[1]
-            if monster.distance(alert_x, alert_y) >= 1:
-                monster.move_towards(alert_x, alert_y)
+            if monster.alert == (player.x, player.y):
+                self.chase(alert_x, alert_y)
+            elif monster.distance(alert_x, alert_y) >= 1:
+                if not self.chase(alert_x, alert_y) and monster.distance(alert_x, alert_y) < 2:
+                    set_alert(monster, None)    #someone else is standing on the spot, close enough
                 #print(monster.name.capitalize() + ' alerted, moving towards ' + str(alert_x) +','+ str(alert_y))
-            else:   #once the monster arrives at the location of the alert, stop moving
-                monster.alert = None
+            elif monster.move_along(scent_map):  #once the monster arrives at the location of the alert, it sniffs out where the player went
+                set_alert(monster, (monster.x, monster.y))
+            else:   #the trail went cold, stop moving
+                set_alert(monster, None)
                 
         else:   #randomly move to a random open space, or don't move at all
-            direction = libtcod.random_get_int(0,1,5)
-            if direction == 1 and not is_blocked(monster.x, monster.y-1):
-                monster.y -= 1
-            if direction == 2 and not is_blocked(monster.x + 1, monster.y):
-                monster.x += 1
-            if direction == 3 and not is_blocked(monster.x, monster.y + 1):
-                monster.y += 1
-            if direction == 4 and not is_blocked(monster.x - 1, monster.y):
-                monster.x -= 1
+            monster.wander()
                 
 class ConfusedMonster:      #AI for a confused monster, moves about randomly and doesn't attack
 
@@ -470,6 +815,7 @@ class ConfusedMonster:      #AI for a confused monster, moves about randomly and
         self.num_turns = num_turns
         
     def take_turn(self):
+        journal_touch(self.owner)
         if self.num_turns >0:
             #move in a random direction
             self.owner.move(libtcod.random_get_int(0,-1,1), libtcod.random_get_int(0,-1,1))
@@ -487,15 +833,27 @@ class ConfusedMonster:      #AI for a confused monster, moves about randomly and
 ###############
 
 def make_map(): #random map generator
-    global map, objects, stairs, room_no
+    global map, objects, object_grid, monster_buckets, stairs, upstairs, room_no, master_objects, master_monsters, alert_users, scent_map, actor_queue, sleeping_since
+    
+    #a new level can't be described as changes to the old one
+    journal_restructure()
     
-    #starting list of objects
+    #starting list of objects, and the occupancy grid that indexes them by tile
     objects = [player]
+    object_grid = {}
+    monster_buckets = {}
+    grid_add(player)
+    #the master lists only ever hold the current level's contents
+    master_objects = []
+    master_monsters = []
+    alert_users = {}
+    scent_map = ScentMap()
+    #every monster starts out asleep, until the player comes near
+    actor_queue = ActorQueue()
+    sleeping_since = {}
     
     #fill map with "blocked" tiles
-    map = [[Tile(True)
-        for y in range(MAP_HEIGHT) ]
-            for x in range(MAP_WIDTH) ]
+    map = TileMap(MAP_WIDTH, MAP_HEIGHT)
             
     #carves the rooms
     rooms = []
@@ -541,8 +899,7 @@ def make_map(): #random map generator
             
             if num_rooms == 0:
                 #this is starting room
-                player.x = new_x
-                player.y = new_y
+                grid_move(player, new_x, new_y)
                 
             else:
                 #all rooms after first
@@ -565,23 +922,27 @@ def make_map(): #random map generator
             rooms.append(new_room)
             num_rooms += 1
     #create stairs at the center of the last room
-    stairs = Object(new_x, new_y, '<', 'stairs', libtcod.white)
+    stairs = Object(new_x, new_y, '<', 'stairs', libtcod.white, dungeon_level=dungeon_level)
     objects.append(stairs)
+    grid_add(stairs)
     stairs.send_to_back()   #drawn below monsters
+    #and stairs back up where the player starts, below the first level
+    upstairs = None
+    if dungeon_level > 1:
+        upstairs = Object(player.x, player.y, '>', 'stairs', libtcod.white, dungeon_level=dungeon_level)
+        objects.append(upstairs)
+        grid_add(upstairs)
+        upstairs.send_to_back()
             
 def create_room(room):  #creates rooms on the map
     global map
-    #go through the tiles in the rectangle and make them passable
-    for x in range(room.x1+1, room.x2):
-        for y in range(room.y1+1, room.y2):
-            map[x][y].blocked = False
-            map[x][y].block_sight = False
+    #go through the rows of the rectangle and make them passable
+    for y in range(room.y1+1, room.y2):
+        map.carve_row(room.x1+1, room.x2, y)
             
 def create_h_tunnel(x1,x2,y):   #creates horizontal segment of hallway
     global map, objects
-    for x in range(min(x1,x2), max(x1,x2)+1):
-        map[x][y].blocked = False
-        map[x][y].block_sight = False
+    map.carve_row(min(x1,x2), max(x1,x2)+1, y)
     # for x in (x1, x2):
         # door_present = libtcod.random_get_int(0,0,1)
         # if door_present == 1:
@@ -591,8 +952,7 @@ def create_h_tunnel(x1,x2,y):   #creates horizontal segment of hallway
 def create_v_tunnel(y1,y2,x):   #creates vertical segment of hallway
     global map, objects
     for y in range(min(y1,y2), max(y1,y2)+1):
-        map[x][y].blocked = False
-        map[x][y].block_sight = False
+        map.set_tile(x, y, False)
     # for y in (y1, y2):
         # door_present = libtcod.random_get_int(0,0,1)
         # if door_present == 1:
@@ -601,16 +961,193 @@ def create_v_tunnel(y1,y2,x):   #creates vertical segment of hallway
             
 def is_blocked(x,y):    #checks if a tile is blocked by something
     #first test the map tile
-    if map[x][y].blocked:
+    if map.is_blocked(x, y):
         return True
         
-    #now check for blocking objects
-    for object in objects:
-        if object.blocks and object.x == x and object.y == y:
+    #now check for blocking objects on that tile
+    for object in object_grid.get((x, y), ()):
+        if object.blocks:
             return True
             
     return False
     
+def change_tile(x, y, blocked, block_sight=None):  #changes one tile of a level in play (doors, digging...), keeping the FOV map and the screen in sync
+    global fov_recompute
+    if block_sight is None: block_sight = blocked
+    map.set_tile(x, y, blocked, block_sight)
+    libtcod.map_set_properties(fov_map, x, y, not block_sight, not blocked)
+    mark_tile_dirty(x, y)
+    #only a tile within the torch's reach can change what the player sees
+    if (x - player.x)**2 + (y - player.y)**2 <= TORCH_RADIUS**2:
+        fov_recompute = True
+    #the ways around the level changed
+    clear_distance_fields()
+    #journal records only hold newly explored tiles, so the changed terrain goes in a fresh save
+    journal_restructure()
+    
+def distance_field(x, y):   #returns the distance field to (x, y), reusing a cached one if there is one
+    field = distance_fields.pop((x, y), None)
+    if field is None:
+        field = DistanceField(x, y)
+        #forget the least recently used field to make room
+        if len(distance_fields) >= DISTANCE_FIELD_CACHE_SIZE:
+            (goal, oldest) = distance_fields.popitem(last=False)
+            oldest.delete()
+    distance_fields[(x, y)] = field
+    return field
+    
+def clear_distance_fields():    #throws away every cached distance field, after the map changed
+    global player_field
+    for field in distance_fields.values():
+        field.delete()
+    distance_fields.clear()
+    if player_field is not None:
+        player_field.delete()
+        player_field = None
+        
+def borrow_path():  #hands out an A* path over fov_map, reusing one from the pool if there is one
+    if path_pool:
+        return path_pool.pop()
+    return libtcod.path_new_using_map(fov_map)
+    
+def release_path(obj):  #gives an object's A* path back to the pool
+    path = monster_paths.pop(obj, None)
+    if path is not None:
+        path_pool.append(path)
+        
+def clear_paths():  #throws away every A* path, after fov_map was replaced
+    global path_pool, monster_paths
+    for path in path_pool + monster_paths.values():
+        libtcod.path_delete(path)
+    path_pool = []
+    monster_paths = {}
+        
+def set_alert(monster, alert):  #points a monster at an alert location (or None), counting how many monsters use each one
+    old_alert = monster.alert
+    if alert == old_alert:
+        return
+    monster.alert = alert
+    journal_touch(monster)
+    if alert is not None:
+        alert_users[alert] = alert_users.get(alert, 0) + 1
+    if old_alert is not None:
+        alert_users[old_alert] -= 1
+        if alert_users[old_alert] == 0:
+            #nobody is heading there anymore, so its distance field can go
+            del alert_users[old_alert]
+            field = distance_fields.pop(old_alert, None)
+            if field is not None:
+                field.delete()
+                
+def count_alert_users():    #recounts the monsters heading to each alert location (after loading a game)
+    global alert_users
+    alert_users = {}
+    for obj in objects:
+        if obj.alert is not None:
+            alert_users[obj.alert] = alert_users.get(obj.alert, 0) + 1
+    
+def player_distance_field():    #returns the distance field to the player, shared by every chasing monster. Only recomputed when the player moved
+    global player_field
+    if player_field is None:
+        player_field = DistanceField(player.x, player.y)
+    elif player_field.goal != (player.x, player.y):
+        player_field.recompute(player.x, player.y)
+    return player_field
+    
+def objects_at(x, y):   #returns the objects standing on a tile, in drawing order
+    return object_grid.get((x, y), ())
+    
+def grid_add(obj):  #adds an object to the occupancy grid at its current position
+    mark_tile_dirty(obj.x, obj.y)
+    if obj.ai:
+        bucket_add(obj)
+    tile_objects = object_grid.get((obj.x, obj.y))
+    if tile_objects is None:
+        object_grid[(obj.x, obj.y)] = [obj]
+    else:
+        tile_objects.append(obj)
+        
+def grid_remove(obj):   #removes an object from the occupancy grid
+    mark_tile_dirty(obj.x, obj.y)
+    if obj.ai:
+        bucket_remove(obj)
+    tile_objects = object_grid[(obj.x, obj.y)]
+    tile_objects.remove(obj)
+    if not tile_objects:
+        del object_grid[(obj.x, obj.y)]
+        
+def grid_move(obj, x, y):   #moves an object to new coords, keeping the occupancy grid in sync
+    grid_remove(obj)
+    obj.x = x
+    obj.y = y
+    grid_add(obj)
+    journal_touch(obj)
+    
+def rebuild_object_grid():  #indexes every object in the objects list by tile (after loading a game)
+    global object_grid, monster_buckets
+    object_grid = {}
+    monster_buckets = {}
+    for obj in objects:
+        grid_add(obj)
+        
+def bucket_add(monster):    #files a monster in the bucket covering its position
+    key = (monster.x // MONSTER_BUCKET_SIZE, monster.y // MONSTER_BUCKET_SIZE)
+    bucket = monster_buckets.get(key)
+    if bucket is None:
+        monster_buckets[key] = [monster]
+    else:
+        bucket.append(monster)
+        
+def bucket_remove(monster): #takes a monster out of its bucket
+    key = (monster.x // MONSTER_BUCKET_SIZE, monster.y // MONSTER_BUCKET_SIZE)
+    bucket = monster_buckets[key]
+    bucket.remove(monster)
+    if not bucket:
+        del monster_buckets[key]
+        
+def monsters_in_range(x, y, radius):    #returns every monster within radius of (x, y), only looking at the buckets the circle touches
+    found = []
+    for bucket_x in range((x - radius) // MONSTER_BUCKET_SIZE, (x + radius) // MONSTER_BUCKET_SIZE + 1):
+        for bucket_y in range((y - radius) // MONSTER_BUCKET_SIZE, (y + radius) // MONSTER_BUCKET_SIZE + 1):
+            for monster in monster_buckets.get((bucket_x, bucket_y), ()):
+                if (monster.x - x)**2 + (monster.y - y)**2 <= radius**2:
+                    found.append(monster)
+    return found
+    
+def wake_monster(monster):  #lets a sleeping monster take turns again, wandering a bit to make up for the turns it slept through
+    slept_since = sleeping_since.pop(monster, None)
+    if slept_since is None:
+        return
+    actor_queue.schedule(monster, global_timer * TURN_TICKS)
+    for i in range(min(global_timer - slept_since, CATCH_UP_TURNS)):
+        monster.wander()
+        
+def settle_monsters():  #after loading, alerted monsters are awake and the rest sleep until the player comes near
+    global actor_queue, sleeping_since
+    actor_queue = ActorQueue()
+    sleeping_since = {}
+    for obj in objects:
+        if obj.ai and obj.alert is not None:
+            actor_queue.schedule(obj, global_timer * TURN_TICKS)
+        elif obj.ai:
+            sleeping_since[obj] = global_timer
+    
+def run_monsters():     #the awake monsters whose time has come act, fast ones more than once a turn, then the turn passes
+    for monster in monsters_in_range(player.x, player.y, WAKE_RADIUS):
+        wake_monster(monster)
+    turn_end = (global_timer + 1) * TURN_TICKS
+    due = actor_queue.pop_due(turn_end)
+    while due is not None:
+        (tick, monster) = due
+        monster.ai.take_turn()
+        if monster.ai:  #it may have died on its own turn
+            if monster.alert is None and monster.distance_to(player) > SLEEP_RADIUS:
+                sleeping_since[monster] = global_timer
+            else:
+                actor_queue.schedule(monster, tick + monster.fighter.action_ticks())
+        due = actor_queue.pop_due(turn_end)
+    turn_passed()
+    
 #   Entity Actions
 ##################
 
@@ -623,8 +1160,8 @@ def player_move_or_attack(dx, dy):  #allows the player to move or attack
     
     #try to find an attackable object there
     target = None
-    for object in objects:
-        if object.fighter and object.x == x and object.y == y:
+    for object in objects_at(x, y):
+        if object.fighter:
             target = object
             break
             
@@ -635,24 +1172,33 @@ def player_move_or_attack(dx, dy):  #allows the player to move or attack
         if noise > player.fighter.critical:
             create_sound(x, y, 0.75)
     else:
+        (old_x, old_y) = (player.x, player.y)
         player.move(dx, dy)
-        fov_recompute = True
+        if (player.x, player.y) != (old_x, old_y):
+            fov_recompute = True
+            scent_map.deposit(old_x, old_y, global_timer)   #leaves a trail monsters can follow
         
 def player_death(player):   #player has died
     #the game ended!
-    global game_state
+    global game_state, redraw_map
     message('You died!', libtcod.red)
     game_state = 'dead'
+    redraw_map = True   #the whole map is revealed
     
     #for added effect, transform the player into a corpse!
     player.char = '%'
     player.color = libtcod.dark_red
     
 def monster_death(monster): #killed a monster
-    global master_monsters, timer_list
+    global master_monsters
     #transform it into a nasty corpse! it doesn't block, can't be attacked
     #and doesn't move
     message(monster.name.capitalize() + ' is dead! You gain ' + str(monster.fighter.xp) + ' experience points.', libtcod.green)
+    bucket_remove(monster)  #no longer a monster, for range queries
+    set_alert(monster, None)
+    release_path(monster)
+    actor_queue.remove(monster)
+    sleeping_since.pop(monster, None)
     monster.char = '%'
     monster.color = libtcod.dark_red
     monster.blocks = False
@@ -661,9 +1207,7 @@ def monster_death(monster): #killed a monster
     monster.name = 'remains of ' + monster.name
     monster.send_to_back()
     master_monsters.remove(monster)
-    for timer in timer_list:
-        if timer.attached_to == monster:
-            timer_list.remove(timer)
+    timer_queue.cancel_all(monster)
     
 def target_tile(max_range=None):    #return the position of a tile left clicked in the FOV(optionally in range) or (None,None) if right clicked
     global key, mouse
@@ -689,8 +1233,8 @@ def target_monster(max_range=None): #returns a clicked monster inside FOV up to
         if x is None:   #cancels
             return None
         #return the first clicked monster, otherwise continue looping
-        for obj in objects:
-            if obj.x == x and obj.y == y and obj.fighter and obj != player:
+        for obj in objects_at(x, y):
+            if obj.fighter and obj != player:
                 return obj
         
 #   GUI Related
@@ -713,8 +1257,11 @@ def render_bar(x, y, total_width, name, value, maximum, bar_color, back_color):
     libtcod.console_set_default_foreground(panel, libtcod.white)
     libtcod.console_print_ex(panel, x + total_width / 2, y, libtcod.BKGND_NONE, libtcod.CENTER,
         name + ': ' + str(value) + '/' + str(maximum))
+    libtcod.console_set_default_background(panel, libtcod.black)    #back to the panel's own color, for whatever is cleared next
         
 def message(new_msg, color = libtcod.white):    #console message
+    global redraw_messages
+    redraw_messages = True
     #split the message if necessary, among multiple lines
     new_msg_lines = textwrap.wrap(new_msg, MSG_WIDTH)
     
@@ -734,8 +1281,8 @@ def get_names_under_mouse():    #gets the names of objects under the mouse curso
     #return a string with the names of all objects under the mouse
     (x, y) = (mouse.cx+camera_x, mouse.cy+camera_y)
     #create a list with the names of all objects at mouse position
-    for obj in objects:
-        if obj.x == x and obj.y == y and libtcod.map_is_in_fov(fov_map, obj.x, obj.y):
+    for obj in objects_at(x, y):
+        if (obj.x, obj.y) in visible_tiles:
             #print(obj.x,obj.y)  #debug message
             if obj.fighter is not None:
                 #print(obj.fighter.hp,obj.fighter.max_hp)  #debug message
@@ -819,6 +1366,7 @@ def menu(header, options, width):   #create a menu
     #present the root console to the player and wait for a key-press
     libtcod.console_flush()
     key = libtcod.console_wait_for_keypress(True)
+    mark_all_dirty()    #the menu was drawn over the game screen
     
     if key.vk == libtcod.KEY_ENTER and key.lalt:
             # Alt+Enter: toggle fullscreen
@@ -832,13 +1380,15 @@ def menu(header, options, width):   #create a menu
 def msgbox(text, width=50): #create a menu with no options, a 'message box'
     menu(text, [], width)   #use menu() as a sort of "message box"
     
-def inventory_menu(header):     #show a menu with each item of the inventory as an option
+def inventory_menu(header, container=None):     #show a menu with each item of the inventory (or a bag in it) as an option
+    if container is None:
+        container = inventory
 
-    if len(inventory) == 0:
+    if len(container) == 0:
         options = ['Inventory is empty.']
     else:
         options = []
-        for item in inventory:
+        for item in container:
             text = item.name
             #show additional info if equipped
             if item.equipment and item.equipment.is_equipped:
@@ -847,41 +1397,33 @@ def inventory_menu(header):     #show a menu with each item of the inventory as
         
     index = menu(header, options, INVENTORY_WIDTH)
     #if an item was chosen, return it
-    if index is None or len(inventory) == 0: return None
-    return inventory[index].item
+    if index is None or len(container) == 0: return None
+    return container[index].item
     
 #   Timer Functions
 ######################
 
-def turn_passed():    #a turn passed
-    global timer_list, global_timer
-    for timer in timer_list:
-        timer.tick()
+def turn_passed():    #a turn passed, sets off every timer that reached 0
+    global global_timer
+    timer = timer_queue.pop_due(global_timer)
+    while timer is not None:
+        timer.fire()
+        timer = timer_queue.pop_due(global_timer)
+    scent_map.expire(global_timer)
     global_timer += 1  
     #print('turn:' + str(global_timer))      #useful for displaying the turn number for debugging
 
 def forget_alert(monster):  #causes a monster to lose alert status
-    global timer_list
-    
-    monster.alert = None
+    set_alert(monster, None)
     #print(monster.name + ' loses interest.')   #prints a message to console when monster's alert is set to none again
-    for timer in timer_list:
-        if timer.attached_to == monster:
-            if timer.timer_name == (monster.name + 'alert'):
-                timer.destroy()
+    alert_timer = timer_queue.find(monster, monster.name + 'alert')
+    if alert_timer is not None:
+        alert_timer.destroy()
                 
 def starve(player):   #hunger timer ran out and player is starving, loses 1 hp a turn until death or hunger timer is refilled
-    global timer_list
-    for timer in timer_list:
-        if timer.attached_to == player:
-            if timer.timer_name == ('hunger_timer'):
-                timer_index = timer_list.index(timer)
-    
-    hunger_timer = timer_list[timer_index]
-    if hunger_timer.counter <= 0:
+    if player.hunger.turns_left() <= 0:
         message('You are starving!', libtcod.yellow)
         player.fighter.take_damage(1)
-        hunger_timer.counter = 0
         
 #   Utility Functions
 ######################
@@ -922,14 +1464,10 @@ def check_level_up():   #handles checking for and leveling up the player
             player.fighter.base_critical += 1
             
 def get_all_equipped(obj):  #returns a list of equipped items
-    if obj == player:
-        equipped_list = []
-        for item in inventory:
-            if item.equipment and item.equipment.is_equipped:
-                equipped_list.append(item.equipment)
-        return equipped_list
+    if obj.fighter:
+        return obj.fighter.slots.values()
     else:
-        return []   #other objects have no equipment
+        return []   #only fighters wear equipment
     
 def random_choice_index(chances):   #choose one option, returning index
     #the dice will land on some number between 1 and the sum of chances
@@ -958,33 +1496,33 @@ def from_dungeon_level(table):      #returns a value that depends on level. tabl
             return value
     return 0
 
-def get_equipped_in_slot(slot): #returns eq in slot or None if empty
-    for obj in inventory:
-        if obj.equipment and obj.equipment.slot == slot and obj.equipment.is_equipped:
-            return obj.equipment
-    return None
+def get_equipped_in_slot(obj, slot):    #returns eq obj is wearing in slot or None if empty
+    return obj.fighter.slots.get(slot)
     
 def create_sound(x, y, sound_intensity):    #generates a sound, which creates an alert at (x,y) for all monsters in range
-    global master_monsters, timer_list, old_timer
     min_sound_range = int(random.uniform(0.5,1.0) * (sound_intensity * 10))
     max_sound_range = int(random.uniform(1.1, 2.0) * (sound_intensity * 10))
     sound_range = libtcod.random_get_int(0, min_sound_range, max_sound_range + 1)
-    for dx in range(x - sound_range, x + sound_range):
-        for dy in range(y - sound_range, y + sound_range):
-            for monster in master_monsters:
-                if (monster.x == dx and monster.y == dy):
-                    monster.alert = (x, y)
-                    for timer in timer_list:
-                        if timer.attached_to == monster and timer.timer_name == (monster.name + 'alert'):
-                            old_timer = timer.counter
-                            timer.destroy()
-                    alert_length = random.randint(5,15)
-                    if alert_length < old_timer:
-                        alert_length = old_timer
-                    alert_timer = Timer(monster.name + 'alert', alert_length, forget_alert, monster, False)
-                    timer_list.append(alert_timer)
-                    #console message for debugging
-                    #print('sound generated at ' + str(x) + ',' + str(y) + ' range:' + str(sound_range) + ' heard by: ' + monster.name)
+    hearers = monsters_in_range(x, y, sound_range)
+    if not hearers:
+        return  #nobody close enough to hear, so there's no need to work out how far the sound travels
+    #sound travels around walls rather than through them, so what counts is the walking distance
+    field = distance_field(x, y)
+    for monster in hearers:
+        distance = field.distance(monster.x, monster.y)
+        if distance is None or distance > sound_range:
+            continue
+        set_alert(monster, (x, y))
+        wake_monster(monster)
+        #a monster that is already alert stays alert at least as long as it would have
+        alert_length = random.randint(5,15)
+        alert_timer = timer_queue.find(monster, monster.name + 'alert')
+        if alert_timer is not None:
+            alert_timer.set_turns_left(max(alert_length, alert_timer.turns_left()))
+        else:
+            timer_queue.add(Timer(monster.name + 'alert', alert_length, forget_alert, monster, False))
+        #console message for debugging
+        #print('sound generated at ' + str(x) + ',' + str(y) + ' range:' + str(sound_range) + ' heard by: ' + monster.name)
         
     
 #$$$$$$$$$$$$$$$$$$$$$$$$$$   
@@ -992,17 +1530,9 @@ def create_sound(x, y, sound_intensity):    #generates a sound, which creates an
 #$$$$$$$$$$$$$$$$$$$$$$$$$$
 
 def eat():     #eat some food, refilling hunger meter
-    global timer_list
-    
-    for timer in timer_list:
-        if timer.timer_name == 'hunger_timer':
-            timer_index = timer_list.index(timer)
-    
     eat_amount = random.randint(int(0.25*EAT_AMOUNT), int(2*EAT_AMOUNT))
-    timer_list[timer_index].counter += eat_amount
     message('Delicious and Satisfying! You feel refreshed!', libtcod.violet)
-    if timer_list[timer_index].counter >= HUNGER_AMOUNT:
-        timer_list[timer_index].counter = HUNGER_AMOUNT
+    player.hunger.feed(eat_amount)
     
 def level_up_heal():    #random heal based on damage sustained
     mod = player.fighter.max_hp - player.fighter.hp
@@ -1050,6 +1580,7 @@ def cast_confuse():     #replace the monster's AI with a confused one; after som
     old_ai = monster.ai
     monster.ai = ConfusedMonster(old_ai)
     monster.ai.owner = monster  #tell the new component who owns it
+    journal_touch(monster)
     message('The eyes of the ' + monster.name + ' look vacant, as he starts to stumble around.', libtcod.light_green)
     
 def cast_fireball():    #damage every fighter in range, including player
@@ -1107,30 +1638,32 @@ def place_objects(room):    #places room contents (items and monsters)
             if choice == 'orc':
                 #create an orc
                 fighter_component = Fighter(hp=20, defense=1, power=4, critical=0, xp=36, death_function=monster_death)
-                ai_component = BasicMonster()
+                ai_component = BasicMonster(pathing=True)
                 monster = Object(x,y,'o', 'orc', libtcod.desaturated_green, blocks=True, fighter=fighter_component, ai=ai_component, dungeon_level=dungeon_level)
                 
             elif choice == 'troll':
                 #create a troll
-                fighter_component = Fighter(hp=30, defense=2, power=8, critical=0, xp=100, death_function=monster_death)
+                fighter_component = Fighter(hp=30, defense=2, power=8, critical=0, xp=100, speed=75, death_function=monster_death)
                 ai_component = BasicMonster()
-                monster = Object(x,y,'T', 'troll', libtcod.darker_green, blocks=True, fighter=fighter_component, ai=ai_component, dungeon_level=dungeon_leve)
+                monster = Object(x,y,'T', 'troll', libtcod.darker_green, blocks=True, fighter=fighter_component, ai=ai_component, dungeon_level=dungeon_level)
                 
             elif choice == 'rat':
                 #create a rat
-                fighter_component = Fighter(hp=15, defense=0, power=2, critical=1, xp = 20, death_function=monster_death)
+                fighter_component = Fighter(hp=15, defense=0, power=2, critical=1, xp = 20, speed=150, death_function=monster_death)
                 ai_component = BasicMonster()
                 monster = Object(x,y,'r', 'rat', libtcod.dark_sepia , blocks=True, fighter=fighter_component, ai=ai_component, dungeon_level=dungeon_level)
                 
             elif choice == 'skeleton':
                 #create a skele
                 fighter_component = Fighter(hp=25, defense=1, power=6, critical=0, xp=50, hit_chance=(ENEMY_HIT_CHANCE + 10), death_function=monster_death)
-                ai_component = BasicMonster()
+                ai_component = BasicMonster(pathing=True)
                 monster = Object(x,y,'S', 'skeleton', libtcod.white, blocks=True, fighter=fighter_component, ai=ai_component, dungeon_level=dungeon_level)
                 
             monster.dungeon_level = dungeon_level
             objects.append(monster)
+            grid_add(monster)
             master_monsters.append(monster)  #adds monster to master_monsters to be drawn at death
+            sleeping_since[monster] = global_timer
         
         
     for i in range(max_items):
@@ -1176,6 +1709,7 @@ def place_objects(room):    #places room contents (items and monsters)
                 
             item.dungeon_level = dungeon_level
             objects.append(item)
+            grid_add(item)
             master_objects.append(item)     #adds item to master_objects to be drawn at death
             item.send_to_back() #items appear below other objects
             
@@ -1184,149 +1718,197 @@ def place_objects(room):    #places room contents (items and monsters)
 #   Rendering
 #rrrrrrrrrrrrrrrr
 
-def render_all():   #handles drawing screen
-
-    global fov_map, color_dark_wall, color_light_wall
-    global color_dark_ground, color_light_ground
-    global fov_recompute, game_state, master_objects, master_monsters, timer_list
-    
-    move_camera(player.x, player.y)
-    
-    if fov_recompute:
-        #recomputes FOV if needed (player move, etc)
-        fov_recompute = False
-        libtcod.map_compute_fov(fov_map, player.x, player.y, TORCH_RADIUS, FOV_LIGHT_WALLS, FOV_ALGO)
-        for object in objects:
-            if libtcod.map_is_in_fov(fov_map, object.x, object.y):
-                if object.item:
-                    object.always_visible = True
-                if object.name == 'stairs':
-                    object.always_visible = True
-        libtcod.console_clear(con)
-    
-    #draw the map
-    for y in range(CAMERA_HEIGHT):
-        for x in range(CAMERA_WIDTH):
-            (map_x, map_y) = (camera_x + x, camera_y + y)
-            visible = libtcod.map_is_in_fov(fov_map, map_x, map_y)
-            wall = map[map_x][map_y].block_sight
-            if game_state == 'dead':    #reveals the map when player dies
-                if wall:
-                    libtcod.console_set_char_background(con,x,y,color_nolight_wall,libtcod.BKGND_SET)
-                else:
-                    libtcod.console_set_char_background(con, x, y, color_nolight_ground, libtcod.BKGND_SET)
-                    
-            if not visible:
-                if map[map_x][map_y].explored:
-                    if wall:
-                        libtcod.console_set_char_background(con,x,y,color_not_in_view_wall,libtcod.BKGND_SET)
-                    else:
-                        libtcod.console_set_char_background(con, x, y, color_not_in_view_ground, libtcod.BKGND_SET)
-            elif game_state == 'dead':      #turns off the lights if the player is dead
-                if wall:
-                    libtcod.console_set_char_background(con,x,y,color_not_in_view_wall,libtcod.BKGND_SET)
-                else:
-                    libtcod.console_set_char_background(con, x, y, color_not_in_view_ground, libtcod.BKGND_SET)
-                    
-            else:
-                if wall:
-                    indx = [0, TORCH_RADIUS - 4, TORCH_RADIUS - 2, TORCH_RADIUS]
-                    key = [color_light_wall, color_dark_wall, color_nolight_wall, color_nolight_wall]
-                    light_map =  libtcod.color_gen_map(key, indx)
-                    distance_from_light = abs(int(player.distance(camera_x +x, camera_y + y)))
-                    if distance_from_light != 0:
-                        wallcolor =  light_map[distance_from_light-1]
-                    else:
-                        wallcolor = color_dark_wall
-                    libtcod.console_set_char_background(con, x, y, wallcolor, libtcod.BKGND_SET)
-                else:
-                    indx = [0, TORCH_RADIUS - 4, TORCH_RADIUS - 2, TORCH_RADIUS]
-                    key = [color_light_ground, color_dark_ground, color_nolight_ground, color_nolight_ground]
-                    light_map =  libtcod.color_gen_map(key, indx)
-                    distance_from_light = abs(int(player.distance(camera_x +x, camera_y + y)))
-                    if distance_from_light != 0:
-                        groundcolor =  light_map[distance_from_light-1]
-                    else:
-                        groundcolor = color_dark_ground
-                    libtcod.console_set_char_background(con,x,y,groundcolor,libtcod.BKGND_SET)
-                #since visible, explores tile
-                map[map_x][map_y].explored = True
+def update_light_tables():  #rebuilds the torch light gradients and distance table, only if the torch radius or light colors changed
+    global light_key, light_index, wall_light, ground_light, unseen_colors, nolight_colors
+    
+    colors = (color_light_wall, color_dark_wall, color_nolight_wall, color_not_in_view_wall,
+        color_light_ground, color_dark_ground, color_nolight_ground, color_not_in_view_ground)
+    key = (TORCH_RADIUS,) + tuple(tuple(color) for color in colors)
+    if key == light_key:
+        return
+    light_key = key
+    
+    #the gradients, indexed by distance from the light. The light's own tile (distance 0) is drawn dark
+    indx = [0, TORCH_RADIUS - 4, TORCH_RADIUS - 2, TORCH_RADIUS]
+    wall_gradient = libtcod.color_gen_map([color_light_wall, color_dark_wall, color_nolight_wall, color_nolight_wall], indx)
+    ground_gradient = libtcod.color_gen_map([color_light_ground, color_dark_ground, color_nolight_ground, color_nolight_ground], indx)
+    wall_light = [tuple(color_dark_wall)] + [tuple(color) for color in wall_gradient]
+    ground_light = [tuple(color_dark_ground)] + [tuple(color) for color in ground_gradient]
+    #colors of tiles out of view, indexed by whether the tile is a wall
+    unseen_colors = (tuple(color_not_in_view_ground), tuple(color_not_in_view_wall))
+    nolight_colors = (tuple(color_nolight_ground), tuple(color_nolight_wall))
+    
+    #distance from the light for every (dx, dy) offset in the torch square, stored row by row
+    light_index = []
+    for dy in range(-TORCH_RADIUS, TORCH_RADIUS + 1):
+        for dx in range(-TORCH_RADIUS, TORCH_RADIUS + 1):
+            light_index.append(min(int(math.sqrt(dx**2 + dy**2)), len(wall_light) - 1))
+    
+def tile_background(map_x, map_y):  #returns the (r, g, b) background of a map tile as currently seen, exploring it if it is lit
+    wall = map.blocks_sight(map_x, map_y)
+    if (map_x, map_y) not in visible_tiles:
+        if map.is_explored(map_x, map_y):
+            return unseen_colors[wall]
+        elif game_state == 'dead':  #reveals the map when player dies
+            return nolight_colors[wall]
+        return (0, 0, 0)
+    elif game_state == 'dead':      #turns off the lights if the player is dead
+        return unseen_colors[wall]
+    
+    #since visible, explores tile
+    map.set_explored(map_x, map_y)
+    #visible tiles are always inside the torch square, so the offset is always in the table
+    distance_from_light = light_index[(map_y - player.y + TORCH_RADIUS) * (2 * TORCH_RADIUS + 1) + (map_x - player.x + TORCH_RADIUS)]
+    if wall:
+        return wall_light[distance_from_light]
+    return ground_light[distance_from_light]
+    
+def draw_char(object):  #draws an object's character, whether or not it is in view
+    (x, y) = to_camera_coordinates(object.x, object.y)
+    if x is not None:
+        #sets the color and then draws the character
+        libtcod.console_set_default_foreground(con,object.color)
+        libtcod.console_put_char(con,x,y,object.char,libtcod.BKGND_NONE)
+        
+def mark_tile_dirty(x, y):  #something on this map tile changed, so redraw it next frame
+    dirty_tiles.add((x, y))
+    
+def mark_all_dirty():   #the whole screen was drawn over (menus etc), so redraw everything next frame
+    global redraw_map, redraw_messages
+    redraw_map = True
+    redraw_messages = True
+    panel_rows.clear()
+    
+def render_map():   #draws every camera cell and every object
+    libtcod.console_clear(con)
+    
+    #every camera cell's background color is worked out here, then handed to libtcod in a single fill call
+    colors = []
+    for y in range(camera_y, camera_y + CAMERA_HEIGHT):
+        for x in range(camera_x, camera_x + CAMERA_WIDTH):
+            colors.append(tile_background(x, y))
+    (back_r, back_g, back_b) = zip(*colors)
+    libtcod.console_fill_background(con, back_r, back_g, back_b)
                 
     #draw all objects in the master list when player dies
     if game_state == 'dead':
         for object in master_objects:   #draw all objects in the level
-            (x, y) = to_camera_coordinates(object.x, object.y)
-            
-            if x is not None:
-                #sets the color and then draws the character
-                libtcod.console_set_default_foreground(con,object.color)
-                libtcod.console_put_char(con,x,y,object.char,libtcod.BKGND_NONE)
-                
+            draw_char(object)
             if object != player:
                 object.draw()
                 
         for object in master_monsters:  #draw all monsters in the level
-            (x, y) = to_camera_coordinates(object.x, object.y)
-            
-            if x is not None:
-                #sets the color and then draws the character
-                libtcod.console_set_default_foreground(con,object.color)
-                libtcod.console_put_char(con,x,y,object.char,libtcod.BKGND_NONE)
-                
+            draw_char(object)
             if object != player:
                 object.draw()
     
     #draw all objects in the list
     for object in objects:
         if object.always_visible==True:
-            (x, y) = to_camera_coordinates(object.x, object.y)
-            
-            if x is not None:
-                #sets the color and then draws the character
-                libtcod.console_set_default_foreground(con,object.color)
-                libtcod.console_put_char(con,x,y,object.char,libtcod.BKGND_NONE)
-                
+            draw_char(object)
         if object != player:
             object.draw()
     player.draw()
     
-        
-        
-    #writes "con" console to the root console
-    libtcod.console_blit(con,0,0,MAP_WIDTH,MAP_HEIGHT,0,0,0)
+def render_tile(map_x, map_y):  #redraws a single map tile and whatever stands on it
+    (x, y) = to_camera_coordinates(map_x, map_y)
+    if x is None:
+        return
+    libtcod.console_set_char_background(con, x, y, libtcod.Color(*tile_background(map_x, map_y)), libtcod.BKGND_SET)
+    libtcod.console_put_char(con, x, y, ' ', libtcod.BKGND_NONE)
+    for object in objects_at(map_x, map_y):
+        if object.always_visible or game_state == 'dead':
+            draw_char(object)
+        else:
+            object.draw()
     
-    #prepare to render the GUI panel
+def render_panel_rows(): #redraws the rows of the GUI panel whose contents changed, returns True if anything was drawn
+    global redraw_messages
+    changed = False
     libtcod.console_set_default_background(panel, libtcod.black)
-    libtcod.console_clear(panel)
     
     #print the game messages, one line at a time
-    y = 1
-    for (line, color) in game_msgs:
-        libtcod.console_set_default_foreground(panel, color)
-        libtcod.console_print_ex(panel, MSG_X, y, libtcod.BKGND_NONE, libtcod.LEFT, line)
-        y += 1
-    
-    #show the player's health
-    render_bar(1, 1, BAR_WIDTH, 'HP', player.fighter.hp, player.fighter.max_hp,
-        libtcod.light_red, libtcod.darker_red)
-    #show player's exp bar
+    if redraw_messages:
+        redraw_messages = False
+        libtcod.console_rect(panel, MSG_X, 1, MSG_WIDTH, MSG_HEIGHT, True, libtcod.BKGND_SET)
+        y = 1
+        for (line, color) in game_msgs:
+            libtcod.console_set_default_foreground(panel, color)
+            libtcod.console_print_ex(panel, MSG_X, y, libtcod.BKGND_NONE, libtcod.LEFT, line)
+            y += 1
+        changed = True
+    
+    #the player's bars and the dungeon level, only redrawn when one of the values shown changes
     level_up_xp = LEVEL_UP_BASE + player.level * LEVEL_UP_FACTOR
-    render_bar(1, 3, BAR_WIDTH, 'Exp', player.fighter.xp, level_up_xp, libtcod.green, libtcod.darker_green)
-    #show the player's hunger bar
-    for timer in timer_list:
-        if timer.timer_name == 'hunger_timer': 
-            timer_index = timer_list.index(timer)
-    hunger_left = timer_list[timer_index].counter
-    render_bar(1, 2, BAR_WIDTH, 'Hunger', hunger_left, HUNGER_AMOUNT, libtcod.darker_yellow, libtcod.darkest_yellow)
-    #show dungeon level 
-    libtcod.console_print_ex(panel, 1, 5, libtcod.BKGND_NONE, libtcod.LEFT, 'Dungeon level ' + str(dungeon_level))
-    
-    #display names of objects under the mouse
-    libtcod.console_set_default_foreground(panel, libtcod.light_gray)
-    libtcod.console_print_ex(panel, 1, 0, libtcod.BKGND_NONE, libtcod.LEFT, get_names_under_mouse())
+    hunger_left = player.hunger.turns_left()
+    stats = (player.fighter.hp, player.fighter.max_hp, player.fighter.xp, level_up_xp, hunger_left, dungeon_level)
+    if panel_rows.get('stats') != stats:
+        panel_rows['stats'] = stats
+        libtcod.console_rect(panel, 0, 1, MSG_X, PANEL_HEIGHT - 1, True, libtcod.BKGND_SET)
+        #show the player's health
+        render_bar(1, 1, BAR_WIDTH, 'HP', player.fighter.hp, player.fighter.max_hp,
+            libtcod.light_red, libtcod.darker_red)
+        #show player's exp bar
+        render_bar(1, 3, BAR_WIDTH, 'Exp', player.fighter.xp, level_up_xp, libtcod.green, libtcod.darker_green)
+        #show the player's hunger bar
+        render_bar(1, 2, BAR_WIDTH, 'Hunger', hunger_left, player.hunger.max_turns, libtcod.darker_yellow, libtcod.darkest_yellow)
+        #show dungeon level 
+        libtcod.console_print_ex(panel, 1, 5, libtcod.BKGND_NONE, libtcod.LEFT, 'Dungeon level ' + str(dungeon_level))
+        changed = True
+    
+    #display names of objects under the mouse, only redrawn when the mouse or what is under it changes
+    names = get_names_under_mouse()
+    if panel_rows.get('names') != names:
+        panel_rows['names'] = names
+        libtcod.console_rect(panel, 0, 0, SCREEN_WIDTH, 1, True, libtcod.BKGND_SET)
+        libtcod.console_set_default_foreground(panel, libtcod.light_gray)
+        libtcod.console_print_ex(panel, 1, 0, libtcod.BKGND_NONE, libtcod.LEFT, names)
+        changed = True
         
+    return changed
+    
+def render_all():   #handles drawing screen. Only the parts that changed since the last frame get redrawn
+    global fov_map, fov_recompute, game_state, visible_tiles
+    global redraw_map, dirty_tiles
+    
+    move_camera(player.x, player.y)
+    update_light_tables()
+    
+    if fov_recompute:
+        #recomputes FOV if needed (player move, etc)
+        fov_recompute = False
+        libtcod.map_compute_fov(fov_map, player.x, player.y, TORCH_RADIUS, FOV_LIGHT_WALLS, FOV_ALGO)
+        #remember which tiles are in view, so the rest of the frame doesn't have to ask libtcod tile by tile.
+        #nothing outside the torch radius can be lit, so only that square needs checking
+        visible_tiles = set()
+        for y in range(max(0, player.y - TORCH_RADIUS), min(MAP_HEIGHT, player.y + TORCH_RADIUS + 1)):
+            for x in range(max(0, player.x - TORCH_RADIUS), min(MAP_WIDTH, player.x + TORCH_RADIUS + 1)):
+                if libtcod.map_is_in_fov(fov_map, x, y):
+                    visible_tiles.add((x, y))
+        for object in objects:
+            if (object.x, object.y) in visible_tiles and not object.always_visible:
+                if object.item or object.name == 'stairs':
+                    object.always_visible = True
+                    journal_touch(object)
+        redraw_map = True
+    
+    #draw the map: all of it if the view changed, otherwise just the tiles where something moved
+    if redraw_map:
+        redraw_map = False
+        dirty_tiles = set()
+        render_map()
+        #writes "con" console to the root console
+        libtcod.console_blit(con,0,0,CAMERA_WIDTH,CAMERA_HEIGHT,0,0,0)
+    elif dirty_tiles:
+        tiles = dirty_tiles
+        dirty_tiles = set()
+        for (x, y) in tiles:
+            render_tile(x, y)
+        libtcod.console_blit(con,0,0,CAMERA_WIDTH,CAMERA_HEIGHT,0,0,0)
+    
     #blit the contents of "panel" to root console
-    libtcod.console_blit(panel, 0, 0, SCREEN_WIDTH, PANEL_HEIGHT, 0, 0, PANEL_Y)
+    if render_panel_rows():
+        libtcod.console_blit(panel, 0, 0, SCREEN_WIDTH, PANEL_HEIGHT, 0, 0, PANEL_Y)
     
     
 #------------------------
@@ -1353,42 +1935,34 @@ def handle_keys():  #handles input
         #movement keys
         if key.vk == libtcod.KEY_UP or key.vk == libtcod.KEY_KP8:
             player_move_or_attack(0,-1)
-            fov_recompute = True
             
         
         elif key.vk == libtcod.KEY_DOWN or key.vk == libtcod.KEY_KP2:
             player_move_or_attack(0,1)
-            fov_recompute = True
             
         
         elif key.vk == libtcod.KEY_LEFT or key.vk == libtcod.KEY_KP4:
             player_move_or_attack(-1,0)
-            fov_recompute = True
             
         
         elif key.vk == libtcod.KEY_RIGHT or key.vk == libtcod.KEY_KP6:
             player_move_or_attack(1,0)
-            fov_recompute = True
             
             
         elif key.vk == libtcod.KEY_HOME or key.vk == libtcod.KEY_KP7:
             player_move_or_attack(-1, -1)
-            fov_recompute = True
             
             
         elif key.vk == libtcod.KEY_PAGEUP or key.vk == libtcod.KEY_KP9:
             player_move_or_attack(1, -1)
-            fov_recompute = True
             
             
         elif key.vk == libtcod.KEY_END or key.vk == libtcod.KEY_KP1:
             player_move_or_attack(-1, 1)
-            fov_recompute = True
             
             
         elif key.vk == libtcod.KEY_PAGEDOWN or key.vk == libtcod.KEY_KP3:
             player_move_or_attack(1, 1)
-            fov_recompute = True
             
             
         elif key.vk == libtcod.KEY_KP5:
@@ -1400,8 +1974,8 @@ def handle_keys():  #handles input
             
             if key_char == 'g':
                 #pick up an item
-                for object in objects:  #look for an item in the player's location
-                    if object.x == player.x and object.y == player.y and object.item:
+                for object in objects_at(player.x, player.y):  #look for an item in the player's location
+                    if object.item:
                         object.item.pick_up()
                         break
                         
@@ -1422,6 +1996,11 @@ def handle_keys():  #handles input
                 if stairs.x == player.x and stairs.y == player.y:
                     next_level()
                     
+            if key_char == '>':
+                #go back up stairs, if the player is on them
+                if upstairs is not None and upstairs.x == player.x and upstairs.y == player.y:
+                    previous_level()
+                    
             if key_char == 'c':
                 #show character info
                 level_up_xp = LEVEL_UP_BASE + player.level * LEVEL_UP_FACTOR
@@ -1432,6 +2011,688 @@ def handle_keys():  #handles input
             return 'didnt-take-turn'
             
             
+#===============================
+#   Save Files
+#===============================
+
+#a save file is SAVE_MAGIC and SAVE_VERSION followed by the compressed sections, each one a 4 letter tag, the length of its data and the data.
+#sections a version doesn't know about are skipped, so new ones can be added without breaking old saves
+
+class SaveWriter:   #packs values into the little-endian binary a save file is made of
+    def __init__(self):
+        self.chunks = []
+        
+    def pack(self, format, *values):
+        self.chunks.append(struct.pack('<' + format, *values))
+        
+    def string(self, text):
+        self.pack('H', len(text))
+        self.chunks.append(text)
+        
+    def color(self, color):
+        self.pack('BBB', color.r, color.g, color.b)
+        
+    def raw(self, data):    #bytes another SaveWriter already packed
+        self.chunks.append(data)
+        
+    def function(self, function):   #functions are saved by name, and looked up in SAVED_FUNCTIONS when loading
+        if function is None:
+            self.string('')
+        else:
+            self.string(function.__name__)
+            
+    def data(self):
+        return ''.join(self.chunks)
+        
+class SaveReader:   #unpacks the values a SaveWriter packed, in the same order
+    def __init__(self, data):
+        self.data = data
+        self.offset = 0
+        
+    def unpack(self, format):
+        format = '<' + format
+        values = struct.unpack_from(format, self.data, self.offset)
+        self.offset += struct.calcsize(format)
+        return values
+        
+    def string(self):
+        (length,) = self.unpack('H')
+        text = self.data[self.offset:self.offset + length]
+        self.offset += length
+        return text
+        
+    def color(self):
+        (r, g, b) = self.unpack('BBB')
+        return libtcod.Color(r, g, b)
+        
+    def function(self):
+        name = self.string()
+        if name == '':
+            return None
+        return SAVED_FUNCTIONS[name]
+        
+#the functions a component can point at
+SAVED_FUNCTIONS = dict((function.__name__, function) for function in
+    (player_death, monster_death, cast_heal, cast_heal_plus, cast_lightning, cast_confuse, cast_fireball, eat, forget_alert, starve))
+    
+#components are saved as one of these type IDs followed by their fields
+FIGHTER_ID = 1
+BASIC_MONSTER_ID = 2
+CONFUSED_MONSTER_ID = 3
+ITEM_ID = 4
+EQUIPMENT_ID = 5
+HUNGER_ID = 6
+
+def write_runs(out, layer):     #writes a map layer as (run length, byte) pairs. Solid rock and open floor shrink down to very little
+    runs = []
+    for run in SAME_RUN.finditer(layer.tostring()):
+        runs.append(run.end() - run.start())
+        runs.append(ord(run.group(1)))
+    out.pack('I', len(runs) / 2)
+    out.pack('IB' * (len(runs) / 2), *runs)
+    
+def read_runs(src):
+    (count,) = src.unpack('I')
+    runs = src.unpack('IB' * count)
+    layer = array('B')
+    layer.fromstring(''.join(chr(runs[i + 1]) * runs[i] for i in range(0, len(runs), 2)))
+    return layer
+    
+def write_tile_map(out, tile_map):
+    out.pack('HH', tile_map.width, tile_map.height)
+    for layer in (tile_map.blocked, tile_map.block_sight, tile_map.explored):
+        write_runs(out, layer)
+        
+def read_tile_map(src):
+    (width, height) = src.unpack('HH')
+    tile_map = TileMap(width, height)
+    tile_map.blocked = read_runs(src)
+    tile_map.block_sight = read_runs(src)
+    tile_map.explored = read_runs(src)
+    return tile_map
+    
+def write_component(out, component):    #writes a component as its type ID followed by its fields
+    if isinstance(component, Fighter):
+        out.pack('Biiiiiiii', FIGHTER_ID, component.base_max_hp, component.hp, component.base_defense, component.base_power,
+            component.base_critical, component.xp, component.base_hit_chance, component.speed)
+        out.function(component.death_function)
+    elif isinstance(component, BasicMonster):
+        out.pack('BB', BASIC_MONSTER_ID, component.pathing)
+    elif isinstance(component, ConfusedMonster):
+        out.pack('Bh', CONFUSED_MONSTER_ID, component.num_turns)
+        write_component(out, component.old_ai)
+    elif isinstance(component, Item):
+        out.pack('B', ITEM_ID)
+        out.function(component.use_function)
+        out.pack('B', component.contents is not None)
+        if component.contents is not None:
+            write_inventory(out, component.contents)
+    elif isinstance(component, Equipment):
+        out.pack('B', EQUIPMENT_ID)
+        out.string(component.slot)
+        out.pack('hhhhhB', component.power_bonus, component.defense_bonus, component.max_hp_bonus, component.critical_bonus,
+            component.hit_bonus, component.is_equipped)
+    elif isinstance(component, Hunger):
+        out.pack('Bi', HUNGER_ID, component.max_turns)
+        
+def read_component(src):    #returns the Object attribute a component belongs in, and the component
+    (type_id,) = src.unpack('B')
+    if type_id == FIGHTER_ID:
+        (max_hp, hp, defense, power, critical, xp, hit_chance, speed) = src.unpack('iiiiiiii')
+        fighter = Fighter(max_hp, defense, power, critical, xp, hit_chance=hit_chance, speed=speed, death_function=src.function())
+        fighter.hp = hp
+        return ('fighter', fighter)
+    elif type_id == BASIC_MONSTER_ID:
+        (pathing,) = src.unpack('B')
+        return ('ai', BasicMonster(pathing=bool(pathing)))
+    elif type_id == CONFUSED_MONSTER_ID:
+        (num_turns,) = src.unpack('h')
+        (attribute, old_ai) = read_component(src)
+        return ('ai', ConfusedMonster(old_ai, num_turns))
+    elif type_id == ITEM_ID:
+        use_function = src.function()
+        (has_contents,) = src.unpack('B')
+        contents = None
+        if has_contents:
+            contents = read_inventory(src)
+        return ('item', Item(use_function=use_function, contents=contents))
+    elif type_id == EQUIPMENT_ID:
+        slot = src.string()
+        (power, defense, max_hp, critical, hit, is_equipped) = src.unpack('hhhhhB')
+        equipment = Equipment(slot, power_bonus=power, defense_bonus=defense, max_hp_bonus=max_hp, critical_bonus=critical, hit_bonus=hit)
+        equipment.is_equipped = bool(is_equipped)
+        return ('equipment', equipment)
+    elif type_id == HUNGER_ID:
+        (max_turns,) = src.unpack('i')
+        return ('hunger', Hunger(max_turns))
+    raise ValueError('unknown component type ' + str(type_id))
+    
+def write_object(out, obj):     #writes an object's fields and components, plus any gear it wears that isn't carried in an inventory
+    flags = int(obj.blocks) | int(obj.always_visible) << 1 | int(obj.alert is not None) << 2
+    out.pack('hhcBH', obj.x, obj.y, obj.char, flags, obj.dungeon_level)
+    out.string(obj.name)
+    out.color(obj.color)
+    if obj.alert is not None:
+        out.pack('hh', obj.alert[0], obj.alert[1])
+    components = [component for component in (obj.fighter, obj.ai, obj.item, obj.equipment, obj.hunger) if component is not None]
+    out.pack('B', len(components))
+    for component in components:
+        write_component(out, component)
+    worn = []
+    if obj.fighter:
+        worn = [equipment.owner for equipment in obj.fighter.slots.values() if equipment.owner.item.container is None]
+    write_objects(out, worn)
+    
+def read_object(src):
+    (x, y, char, flags, dungeon_level) = src.unpack('hhcBH')
+    name = src.string()
+    color = src.color()
+    obj = Object(x, y, char, name, color, dungeon_level=dungeon_level, blocks=bool(flags & 1), always_visible=bool(flags & 2))
+    if flags & 4:
+        obj.alert = src.unpack('hh')
+    (count,) = src.unpack('B')
+    for i in range(count):
+        (attribute, component) = read_component(src)
+        setattr(obj, attribute, component)
+        component.owner = obj
+        if isinstance(component, ConfusedMonster):
+            component.old_ai.owner = obj
+    #worn gear is hooked straight back up, the way finish_loading does the player's. equip would look for the player, who may not be loaded yet
+    for gear in read_objects(src):
+        gear.equipment.wearer = obj
+        obj.fighter.slots[gear.equipment.slot] = gear.equipment
+    return obj
+    
+def write_objects(out, objs):
+    out.pack('I', len(objs))
+    for obj in objs:
+        write_object(out, obj)
+        
+def read_objects(src):
+    (count,) = src.unpack('I')
+    return [read_object(src) for i in range(count)]
+    
+def write_inventory(out, container):
+    out.pack('H', container.capacity)
+    write_objects(out, list(container))
+    
+def read_inventory(src):
+    (capacity,) = src.unpack('H')
+    container = Inventory(capacity)
+    for obj in read_objects(src):
+        container.append(obj)
+    return container
+    
+def write_game_section(out):    #GAME: the odds and ends that aren't part of the map or an object
+    out.pack('HIiIIH', dungeon_level, global_timer, player.hunger.turns_left(), objects.index(player), objects.index(stairs), player.level)
+    out.string(game_state)
+    
+def write_messages(out):    #MSGS: the message log
+    out.pack('H', len(game_msgs))
+    for (line, color) in game_msgs:
+        out.string(line)
+        out.color(color)
+        
+def read_messages(src):
+    (count,) = src.unpack('H')
+    messages = []
+    for i in range(count):
+        line = src.string()
+        messages.append((line, src.color()))
+    return messages
+    
+def owner_timers(obj):  #returns (name, deadline, number_of_turns, repeat, zero_function) for each timer attached to an object.
+    #the hunger timer is left out, it restarts from the hunger left
+    return [(timer.timer_name, timer.deadline, timer.number_of_turns, timer.repeat, timer.zero_function)
+        for timer in timer_queue.by_owner.get(obj, {}).values() if not (obj.hunger and obj.hunger.timer is timer)]
+        
+def timer_table(objs):  #returns {index in objs: timers} for every object in objs that has timers
+    return dict((index, owner_timers(obj)) for (index, obj) in enumerate(objs) if obj in timer_queue.by_owner)
+    
+def write_timers(out, timers):
+    out.pack('B', len(timers))
+    for (timer_name, deadline, number_of_turns, repeat, zero_function) in timers:
+        out.pack('IiB', deadline, number_of_turns, repeat)
+        out.string(timer_name)
+        out.function(zero_function)
+        
+def read_timers(src):
+    (count,) = src.unpack('B')
+    timers = []
+    for i in range(count):
+        (deadline, number_of_turns, repeat) = src.unpack('IiB')
+        timer_name = src.string()
+        timers.append((timer_name, deadline, number_of_turns, bool(repeat), src.function()))
+    return timers
+    
+def write_timer_table(out, table):
+    out.pack('I', len(table))
+    for (index, timers) in table.items():
+        out.pack('I', index)
+        write_timers(out, timers)
+        
+def read_timer_table(src):
+    (count,) = src.unpack('I')
+    timers = {}
+    for i in range(count):
+        (index,) = src.unpack('I')
+        timers[index] = read_timers(src)
+    return timers
+    
+def restore_timers(table, delay=0):     #starts timers from a timer table back up for the objects list, each going off on the turn it was going to (plus delay)
+    for (index, timers) in table.items():
+        for (timer_name, deadline, number_of_turns, repeat, zero_function) in timers:
+            timer = Timer(timer_name, number_of_turns, zero_function, objects[index], repeat)
+            timer_queue.add(timer)
+            timer_queue.schedule(timer, deadline + delay)
+            
+def seed_random(tcod_seed, python_seed):    #restarts libtcod's default generator and python's random from the given seeds
+    fresh = libtcod.random_new_from_seed(tcod_seed)
+    libtcod.random_restore(0, fresh)
+    libtcod.random_delete(fresh)
+    random.seed(python_seed)
+    
+def write_random_section(out):  #RAND: seeds both generators carry on from
+    #libtcod's generator state can only be copied to another generator, not read out, so it is reseeded here with a seed drawn from
+    #itself, and the same seed is saved. A loaded game then rolls exactly what this one is about to
+    tcod_seed = libtcod.random_get_int(0, 0, 0x7FFFFFFF)
+    python_seed = random.randint(0, 0x7FFFFFFF)
+    seed_random(tcod_seed, python_seed)
+    out.pack('II', tcod_seed, python_seed)
+    
+def write_level_section(out):   #LVLS: the stairs up from this level, which page file goes with the save, and where in it every level in the level store is
+    upstairs_index = -1
+    if upstairs is not None:
+        upstairs_index = objects.index(upstairs)
+    out.pack('QiIH', level_store.serial, upstairs_index, level_store.end, len(level_store.pages))
+    for (other, (offset, length)) in sorted(level_store.pages.items()):
+        out.pack('HII', other, offset, length)
+        
+#the sections written to a save file, in order
+SAVE_SECTIONS = (
+    ('GAME', write_game_section),
+    ('TILE', lambda out: write_tile_map(out, map)),
+    ('ENTS', lambda out: write_objects(out, objects)),
+    ('INVT', lambda out: write_inventory(out, inventory)),
+    ('MSGS', write_messages),
+    ('TIMR', lambda out: write_timer_table(out, timer_table(objects))),
+    ('RAND', write_random_section),
+    ('LVLS', write_level_section),
+    ('JRNL', lambda out: out.pack('Q', journal_serial)))
+
+def save_data():    #returns the whole game's sections, uncompressed. Cheap enough to run between turns
+    chunks = []
+    for (tag, write_section) in SAVE_SECTIONS:
+        out = SaveWriter()
+        write_section(out)
+        data = out.data()
+        chunks.append(struct.pack('<4sI', tag, len(data)))
+        chunks.append(data)
+    return ''.join(chunks)
+    
+def replace_file(source, target):   #renames source over target in one step, so a crash leaves one file or the other and never half of one
+    if os.name == 'nt':
+        #os.rename won't overwrite an existing file on Windows, but MoveFileEx will
+        MOVEFILE_REPLACE_EXISTING = 0x1
+        MOVEFILE_WRITE_THROUGH = 0x8
+        if not ctypes.windll.kernel32.MoveFileExW(unicode(source), unicode(target), MOVEFILE_REPLACE_EXISTING | MOVEFILE_WRITE_THROUGH):
+            raise ctypes.WinError()
+    else:
+        os.rename(source, target)
+        
+def write_save_file(data, level_file):  #runs on the save thread: compresses the sections and writes them over the save file
+    global save_error, save_size
+    try:
+        os.fsync(level_file)    #the level pages the save lists have to be on disk before it is
+        header = struct.pack('<4sH', SAVE_MAGIC, SAVE_VERSION)
+        data = zlib.compress(data)
+        file = open(SAVE_FILE + '.tmp', 'wb')
+        file.write(header)
+        file.write(data)
+        file.flush()
+        os.fsync(file.fileno())
+        file.close()
+        replace_file(SAVE_FILE + '.tmp', SAVE_FILE)
+        save_size = len(header) + len(data)
+    except (IOError, OSError) as error:
+        save_error = error
+        
+def read_sections(data):    #splits the contents of a save file into a reader for each section, by tag
+    (magic, version) = struct.unpack_from('<4sH', data, 0)
+    if magic != SAVE_MAGIC or version != SAVE_VERSION:
+        raise ValueError('not a save file this version can load')
+    data = zlib.decompress(data[struct.calcsize('<4sH'):])
+    offset = 0
+    sections = {}
+    while offset < len(data):
+        (tag, length) = struct.unpack_from('<4sI', data, offset)
+        offset += struct.calcsize('<4sI')
+        sections[tag] = SaveReader(data[offset:offset + length])
+        offset += length
+    return sections
+    
+#   Autosave Journal
+######################
+
+#every turn, autosave appends a record of what changed to the journal: the game counters, newly explored tiles, and the
+#objects that changed, by their position in the objects list of the save the journal goes with. An object that only moved
+#since it was last saved or journaled is written as its new position, anything else as its whole record.
+#anything a record can't describe (items changing hands, terrain changing, a new level) sets journal_compact, and the next autosave
+#writes a fresh save and empties the journal instead. So does the journal growing bigger than the save file, which keeps
+#the journal and the time spent replaying it no bigger than one save. Loading replays the journal onto the save
+
+def journal_touch(obj):     #notes that an object changed this turn
+    journal_objects.add(obj)
+    
+def journal_restructure():  #notes that something changed that only a fresh save can hold
+    global journal_compact
+    journal_compact = True
+    
+def start_journal():    #starts a journal to go with the save numbered journal_serial. Records wait in journal_pending until that save is on disk
+    global journal_file, journal_pending, journal_ids, journal_objects, journal_tiles, journal_compact, journal_bytes, journal_written
+    #the old journal stays on disk, still matching the old save, until the new save has replaced it
+    if journal_file is not None:
+        journal_file.close()
+        journal_file = None
+    journal_pending = []
+    journal_ids = dict((obj, index) for (index, obj) in enumerate(objects))
+    journal_objects = set()
+    journal_written = dict((obj, object_record(obj)) for obj in objects)   #what the save holds for each object
+    journal_tiles = []
+    journal_compact = False
+    journal_bytes = 0
+    
+def object_record(obj):     #an object's record and timers, as the journal writes them
+    out = SaveWriter()
+    write_object(out, obj)
+    write_timers(out, owner_timers(obj))
+    return out.data()
+    
+def autosave():     #saves this turn's changes to the journal, or writes a fresh save when it's time to compact
+    global journal_bytes
+    journal_objects.add(player)     #the player changes nearly every turn anyway
+    poll_save()
+    if journal_compact or journal_bytes > save_size or not journal_objects.issubset(journal_ids):
+        save_game()
+        return
+    out = SaveWriter()
+    out.pack('IiH', global_timer, player.hunger.turns_left(), player.level)
+    out.string(game_state)
+    out.pack('I', len(journal_tiles))
+    out.pack('I' * len(journal_tiles), *journal_tiles)
+    changes = SaveWriter()
+    count = 0
+    for obj in journal_objects:
+        record = object_record(obj)
+        last = journal_written.get(obj)
+        if record == last:
+            continue    #touched, but back the way it was last written
+        #an object record starts with its position, so if the rest matches what was last written the position is enough
+        if last is not None and record[JOURNAL_POSITION_SIZE:] == last[JOURNAL_POSITION_SIZE:]:
+            changes.pack('IBhh', journal_ids[obj], JOURNAL_MOVED, obj.x, obj.y)
+        else:
+            changes.pack('IB', journal_ids[obj], JOURNAL_CHANGED)
+            changes.raw(record)
+        journal_written[obj] = record
+        count += 1
+    out.pack('I', count)
+    out.raw(changes.data())
+    data = out.data()
+    record = struct.pack('<I', len(data)) + data
+    if journal_file is None:    #the save this journal goes with is still being written
+        journal_pending.append(record)
+    else:
+        journal_file.write(record)
+        journal_file.flush()
+    journal_objects.clear()
+    del journal_tiles[:]
+    journal_bytes += len(record)
+    
+def finish_save():  #once the save thread is done, opens the new journal and writes out the records that waited for it
+    global save_thread, save_error, journal_file, journal_pending, journal_compact
+    save_thread = None
+    if save_error is not None:
+        message('Saving the game failed: ' + str(save_error), libtcod.red)
+        save_error = None
+        journal_pending = []
+        journal_compact = True  #try again next turn
+        return
+    if level_store.fresh:   #the save lists the new page file now, so it can take the old one's place
+        try:
+            level_store.swap_in()
+        except (IOError, OSError) as error:     #loading finishes the move
+            message('Moving the level pages into place failed: ' + str(error), libtcod.red)
+    journal_file = open(JOURNAL_FILE, 'wb')
+    journal_file.write(struct.pack('<4sQ', JOURNAL_MAGIC, journal_serial))
+    for record in journal_pending:
+        journal_file.write(record)
+    journal_file.flush()
+    journal_pending = []
+    
+def poll_save():    #finishes up the save thread's work if it is done, without waiting
+    if save_thread is not None and not save_thread.is_alive():
+        finish_save()
+        
+def wait_for_save():    #waits for the save thread, if it is still writing
+    if save_thread is not None:
+        save_thread.join()
+        finish_save()
+        
+def read_journal(serial):   #returns a reader for each whole record in the journal that goes with the save numbered serial
+    try:
+        file = open(JOURNAL_FILE, 'rb')
+    except IOError:
+        return []
+    data = file.read()
+    file.close()
+    offset = struct.calcsize('<4sQ')
+    if len(data) < offset or struct.unpack_from('<4sQ', data, 0) != (JOURNAL_MAGIC, serial):
+        return []   #missing, or left over from some other save
+    records = []
+    while offset + 4 <= len(data):
+        (length,) = struct.unpack_from('<I', data, offset)
+        offset += 4
+        if offset + length > len(data):
+            break   #the game stopped partway through writing this one
+        records.append(SaveReader(data[offset:offset + length]))
+        offset += length
+    return records
+    
+#   Level Store
+######################
+
+#a level the player leaves goes into the level store under its dungeon level, with its timers taken off the timer queue,
+#and time stands still there until the player comes back. The levels next to the player's stay in memory so taking the
+#stairs is instant, the rest are only kept in LEVEL_FILE, so memory doesn't grow with depth.
+#LEVEL_FILE is only ever appended to. A level is packed and written to it once, when the player leaves it, and a page is
+#never changed after that. So the save file only has to list where each level's page is, and those pages stay good
+#for as long as that save is the latest, even if the game goes on storing levels after it.
+#a fresh page file starts out as LEVEL_FILE.tmp, with a serial in its header, and only takes LEVEL_FILE's place once a save
+#that lists that serial is on disk. Until then the last save's pages stay where it expects them.
+#a new game starts a fresh page file, and so does a save that finds the pages nothing uses any more outweigh the ones in use
+
+class Level:    #everything on a dungeon level the player isn't on
+    def __init__(self, map, objects, stairs, upstairs, timers, left_at):
+        self.map = map
+        self.objects = objects      #everything on the level but the player
+        self.stairs = stairs
+        self.upstairs = upstairs
+        self.timers = timers        #timer table of objects
+        self.left_at = left_at      #the turn the player left on, the timers pick up from there when they come back
+        
+class LevelStore:   #the levels the player has left, by dungeon level. Each one has a page in LEVEL_FILE, and the ones near the player are in memory too
+    def __init__(self, pages=None, end=0, serial=None):     #an empty store in a fresh page file, or the one a save file lists the pages of
+        self.resident = {}          #dungeon level -> Level
+        self.pages = pages or {}    #dungeon level -> (offset, length) of the level's packed record in the page file
+        if serial is None:
+            self.start_file()
+        else:
+            self.serial = serial
+            self.fresh = False
+            self.file = open_page_file(serial)
+            self.end = end          #where the next page goes. Anything past it was written after the save and is unused
+            
+    def start_file(self):   #starts a fresh page file, with no pages in it yet
+        self.serial = struct.unpack('<Q', os.urandom(8))[0]
+        self.fresh = True       #no save lists this page file yet, so it is still LEVEL_FILE.tmp
+        self.file = open(LEVEL_FILE + '.tmp', 'w+b')
+        self.file.write(struct.pack('<4sQ', LEVEL_MAGIC, self.serial))
+        self.end = self.file.tell()
+        
+    def swap_in(self):  #moves a fresh page file over LEVEL_FILE, once a save that lists it is on disk
+        self.file.close()   #Windows won't rename an open file
+        try:
+            replace_file(LEVEL_FILE + '.tmp', LEVEL_FILE)
+            self.fresh = False
+        finally:
+            if self.fresh:
+                self.file = open(LEVEL_FILE + '.tmp', 'r+b')
+            else:
+                self.file = open(LEVEL_FILE, 'r+b')
+                
+    def __contains__(self, dungeon_level):
+        return dungeon_level in self.pages
+        
+    def put(self, dungeon_level, level):    #stores the level the player just left
+        self.write(dungeon_level, pack_level(level))
+        self.resident[dungeon_level] = level
+        
+    def take(self, dungeon_level):  #removes a level from the store to put it back in play, reading it in if it was paged out
+        level = self.resident.pop(dungeon_level, None)
+        if level is None:
+            level = unpack_level(self.read(dungeon_level))
+        del self.pages[dungeon_level]   #the page goes stale as soon as the level is played on. It is left for any save that lists it
+        return level
+        
+    def read(self, dungeon_level):
+        (offset, length) = self.pages[dungeon_level]
+        self.file.seek(offset)
+        return self.file.read(length)
+        
+    def write(self, dungeon_level, record):     #adds a page to the end of the page file
+        self.file.seek(self.end)
+        self.file.write(record)
+        self.file.flush()
+        self.pages[dungeon_level] = (self.end, len(record))
+        self.end += len(record)
+        
+    def settle(self, dungeon_level):    #keeps the levels within RESIDENT_LEVELS of dungeon_level in memory and drops the rest, which are already on their pages
+        for other in sorted(self.pages):
+            near = abs(other - dungeon_level) <= RESIDENT_LEVELS
+            if near and other not in self.resident:
+                self.resident[other] = unpack_level(self.read(other))
+            elif not near and other in self.resident:
+                del self.resident[other]
+                
+    def compact(self):  #once the pages of levels taken back out of the store take up more room than the rest, copies the rest to a fresh page file
+        live = sum(length for (offset, length) in self.pages.values())
+        dead = self.end - struct.calcsize('<4sQ') - live
+        if self.fresh or dead <= live:
+            return
+        records = [(other, self.read(other)) for other in sorted(self.pages)]
+        self.file.close()   #the old page file stays on disk for the old save, until the save that lists the fresh one replaces it
+        self.pages = {}
+        self.start_file()
+        for (other, record) in records:
+            self.write(other, record)
+            
+    def close(self):
+        self.file.close()
+        
+def open_page_file(serial):     #opens the page file a save lists, finishing the move from LEVEL_FILE.tmp if the game stopped before it was done
+    header = struct.pack('<4sQ', LEVEL_MAGIC, serial)
+    for path in (LEVEL_FILE, LEVEL_FILE + '.tmp'):
+        try:
+            file = open(path, 'r+b')
+        except IOError:
+            continue
+        if file.read(len(header)) == header:
+            if path != LEVEL_FILE:
+                file.close()
+                replace_file(path, LEVEL_FILE)
+                file = open(LEVEL_FILE, 'r+b')
+            return file
+        file.close()
+    raise ValueError('the level pages this save lists are missing')
+    
+def pack_level(level):  #packs a stored level into a compressed record
+    out = SaveWriter()
+    out.pack('I', level.left_at)
+    write_tile_map(out, level.map)
+    write_objects(out, level.objects)
+    upstairs_index = -1
+    if level.upstairs is not None:
+        upstairs_index = level.objects.index(level.upstairs)
+    out.pack('Ii', level.objects.index(level.stairs), upstairs_index)
+    write_timer_table(out, level.timers)
+    return zlib.compress(out.data())
+    
+def unpack_level(record):
+    src = SaveReader(zlib.decompress(record))
+    (left_at,) = src.unpack('I')
+    tile_map = read_tile_map(src)
+    level_objects = read_objects(src)
+    (stairs_index, upstairs_index) = src.unpack('Ii')
+    level_upstairs = None
+    if upstairs_index >= 0:
+        level_upstairs = level_objects[upstairs_index]
+    return Level(tile_map, level_objects, level_objects[stairs_index], level_upstairs, read_timer_table(src), left_at)
+    
+def reset_level_store(pages=None, end=0, serial=None):  #starts over with an empty level store, or picks up the pages a save file lists
+    global level_store
+    wait_for_save()     #the save thread may still be flushing the old page file
+    if level_store is not None:
+        level_store.close()
+    level_store = LevelStore(pages, end, serial)
+    
+def benchmark_save(rounds=20):  #saves and loads a new game over and over in the binary format and the old shelve one, and prints how they compare
+    global SAVE_FILE, JOURNAL_FILE, LEVEL_FILE, journal_file, level_store
+    #the benchmark saves to files of its own, so the player's save, journal and level pages are left alone
+    save_files = (SAVE_FILE, JOURNAL_FILE, LEVEL_FILE)
+    (SAVE_FILE, JOURNAL_FILE, LEVEL_FILE) = BENCHMARK_FILES
+    try:
+        new_game()
+        #a monster wearing a shield, so the round trip covers gear worn by something other than the player
+        wearer_index = next(index for (index, obj) in enumerate(objects) if obj.fighter and obj is not player)
+        shield = Object(0, 0, '[', 'shield', libtcod.darker_orange, equipment=Equipment(slot='left hand', defense_bonus=1))
+        shield.equipment.equip(objects[wearer_index])
+        for (name, save, load) in (('binary', save_game_and_wait, load_game), ('shelve', save_game_shelve, load_game_shelve)):
+            start = time.time()
+            for i in range(rounds):
+                save()
+            save_time = (time.time() - start) / rounds
+            start = time.time()
+            for i in range(rounds):
+                load()
+            load_time = (time.time() - start) / rounds
+            if name == 'binary':
+                wearer = objects[wearer_index]
+                worn = wearer.fighter.slots.get('left hand')
+                if worn is None or worn.owner.name != 'shield' or worn.wearer is not wearer:
+                    raise ValueError('the shield the ' + wearer.name + ' wore did not survive saving and loading')
+                size = os.path.getsize(SAVE_FILE)
+            else:   #depending on the dbm module, shelve may add its own extensions
+                paths = [SHELVE_FILE + extension for extension in SHELVE_EXTENSIONS]
+                size = sum(os.path.getsize(path) for path in paths if os.path.isfile(path))
+            print('%s: %d bytes, %.1f ms to save, %.1f ms to load' % (name, size, save_time * 1000, load_time * 1000))
+    finally:
+        #nothing may still be writing to the benchmark's files once the names are put back
+        wait_for_save()
+        if journal_file is not None:
+            journal_file.close()
+            journal_file = None
+        if level_store is not None:
+            level_store.close()
+            level_store = None
+        (SAVE_FILE, JOURNAL_FILE, LEVEL_FILE) = save_files
+        #and the files it made are cleared away
+        paths = [path + extension for path in BENCHMARK_FILES for extension in ('', '.tmp')]
+        paths += [SHELVE_FILE + extension for extension in SHELVE_EXTENSIONS]
+        for path in paths:
+            if os.path.isfile(path):
+                os.remove(path)
+        
+        
 #XXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXX
 #    Initialization & Main Loop Functions
 #XXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXX
@@ -1468,32 +2729,29 @@ def main_menu():    #main game menu
             play_game()
         
 def new_game(): #set up a new game
-    global player, inventory, game_msgs, game_state, timer_list, global_timer, dungeon_level, master_objects, master_monsters, old_timer
+    global player, inventory, game_msgs, game_state, timer_queue, global_timer, dungeon_level, master_objects, master_monsters
     
     #creates the player
     fighter_component = Fighter(hp=PLAYER_HP, defense=PLAYER_DEFENSE, power=PLAYER_POWER, critical=PLAYER_CRITICAL, hit_chance=PLAYER_HIT_CHANCE, xp=0, death_function=player_death)
-    player = Object(0,0,'@', 'player', libtcod.white, blocks=True, fighter=fighter_component)
+    player = Object(0,0,'@', 'player', libtcod.white, blocks=True, fighter=fighter_component, hunger=Hunger())
     player.level = 1
 
     dungeon_level = 1
     
-    #makes the map
-    master_objects = []
-    master_monsters = []
+    #creates the timer queue and the global timer
+    timer_queue = TimerQueue()
+    global_timer = 0
+    player.hunger.start()
+    
+    #makes the map, with no levels left behind yet
+    reset_level_store()
     make_map()
     
     #create message list and colors, starts empty
     game_msgs = []
     
-    #creates the list of timers and the global timer
-    timer_list = []
-    global_timer = 0
-    old_timer = 0
-    hunger_timer = Timer('hunger_timer', HUNGER_AMOUNT, starve, player, False)
-    timer_list.append(hunger_timer)
-    
     #creates the inventory
-    inventory = []
+    inventory = Inventory()
     
     #initializes FOV
     initialize_fov()
@@ -1522,19 +2780,23 @@ def new_game(): #set up a new game
     item.always_visible = True
 
 def initialize_fov():   #initialize the FOV
-        global fov_recompute, fov_map
+        global fov_recompute, fov_map, visible_tiles
+        clear_distance_fields()     #they were worked out on the old fov_map
+        clear_paths()
         fov_recompute = True
+        visible_tiles = set()
+        mark_all_dirty()
     
         ######## FOV
+        #a new libtcod map starts out as solid rock, so only the carved out tiles need to be set
         fov_map = libtcod.map_new(MAP_WIDTH, MAP_HEIGHT)
-        for y in range(MAP_HEIGHT):
-            for x in range(MAP_WIDTH):
-                libtcod.map_set_properties(fov_map, x, y, not map[x][y].block_sight, not map[x][y].blocked)
+        for (x, y) in map.open_tiles():
+            libtcod.map_set_properties(fov_map, x, y, not map.blocks_sight(x, y), not map.is_blocked(x, y))
         
         libtcod.console_clear(con)  #unexplored areas start black
 
 def play_game():    #play the game!
-    global camera_x, camera_y, key, mouse, master_monsters
+    global camera_x, camera_y, key, mouse
             
     player_action = None
             
@@ -1558,26 +2820,91 @@ def play_game():    #play the game!
         #check for a level up for player
         check_level_up()
     
-        #clears old position
-        for object in objects:
-            object.clear()
-    
         #handle keys and exit game if needed
         player_action = handle_keys()
         if player_action == 'exit':
-            save_game()
+            save_game_and_wait()    #the only time the game waits for the disk
             break
 
         #let monsters take their turn
         if game_state == 'playing' and player_action != 'didnt-take-turn':
-            for object in master_monsters:
-                if object.ai:
-                    object.ai.take_turn()
-            turn_passed()
+            run_monsters()
+            autosave()
             
-def save_game():    #save game, creates 1 save file that gets overwritten each time you save
+def save_game():    #save game, creates 1 save file that gets overwritten each time you save, and starts a new autosave journal to go with it
+    global journal_serial, save_thread
+    poll_save()
+    if save_thread is not None:     #one save at a time, so an older one can't land on top of a newer one
+        journal_restructure()   #try again next turn rather than waiting for the disk
+        return
+    journal_serial = max(journal_serial + 1, int(time.time() * 1000))
+    level_store.compact()
+    #the game is packed up here, between turns, and the save thread compresses it and writes it out
+    save_thread = threading.Thread(target=write_save_file, args=(save_data(), level_store.file.fileno()))
+    save_thread.start()
+    start_journal()
+    
+def save_game_and_wait():   #saves the game and waits until it is on disk
+    wait_for_save()
+    save_game()
+    wait_for_save()
+    
+def load_game():    #load the save file (last game)
+    global map, objects, player, inventory, game_msgs, game_state, dungeon_level, stairs, upstairs, timer_queue, global_timer
+    
+    wait_for_save()
+    file = open(SAVE_FILE, 'rb')
+    sections = read_sections(file.read())
+    file.close()
+    src = sections['GAME']
+    (dungeon_level, global_timer, hunger_left, player_index, stairs_index, player_level) = src.unpack('HIiIIH')
+    game_state = src.string()
+    map = read_tile_map(sections['TILE'])
+    objects = read_objects(sections['ENTS'])
+    inventory = read_inventory(sections['INVT'])
+    timers = read_timer_table(sections['TIMR'])
+    #replay the autosave journal on top
+    (serial,) = sections['JRNL'].unpack('Q')
+    for src in read_journal(serial):
+        (global_timer, hunger_left, player_level) = src.unpack('IiH')
+        game_state = src.string()
+        (count,) = src.unpack('I')
+        for index in src.unpack('I' * count):
+            map.explored[index] = 1
+        (count,) = src.unpack('I')
+        for i in range(count):
+            (index, change) = src.unpack('IB')
+            if change == JOURNAL_MOVED:
+                (objects[index].x, objects[index].y) = src.unpack('hh')
+            else:
+                objects[index] = read_object(src)
+                timers[index] = read_timers(src)
+    player = objects[player_index]
+    player.level = player_level
+    stairs = objects[stairs_index]
+    #the levels the player has left go back in the level store
+    src = sections['LVLS']
+    (page_serial, upstairs_index, end, count) = src.unpack('QiIH')
+    upstairs = None
+    if upstairs_index >= 0:
+        upstairs = objects[upstairs_index]
+    pages = {}
+    for i in range(count):
+        (other, offset, length) = src.unpack('HII')
+        pages[other] = (offset, length)
+    reset_level_store(pages, end, page_serial)
+    level_store.settle(dungeon_level)
+    game_msgs = read_messages(sections['MSGS'])
+    #restart the player's hunger where it was left
+    timer_queue = TimerQueue()
+    player.hunger.start(hunger_left)
+    restore_timers(timers)
+    seed_random(*sections['RAND'].unpack('II'))
+    finish_loading()
+    
+def save_game_shelve():     #the old save, pickling the whole game into a shelve. Only kept to benchmark the binary save against
     #open a new empty shelve(possibly overwriting an old one)
-    file = shelve.open('savegame', 'n')
+    file = shelve.open(SHELVE_FILE, 'n')
     file['map'] = map
     file['objects'] = objects
     file['player_index'] = objects.index(player)    #index of player
@@ -1586,13 +2913,14 @@ def save_game():    #save game, creates 1 save file that gets overwritten each t
     file['game_state'] = game_state
     file['stairs_index'] = objects.index(stairs)
     file['dungeon_level'] = dungeon_level
+    file['global_timer'] = global_timer
+    file['hunger_left'] = player.hunger.turns_left()
     file.close()
     
-def load_game():    #load the save file (last game)
-    #open the previously saved shelve and load the game data
-    global map, objects, player, inventory, game_msgs, game_state, dungeon_level, stairs
+def load_game_shelve():     #loads what save_game_shelve saved. It doesn't hold the levels the player has left
+    global map, objects, player, inventory, game_msgs, game_state, dungeon_level, stairs, upstairs, timer_queue, global_timer
     
-    file = shelve.open('savegame', 'r')
+    file = shelve.open(SHELVE_FILE, 'r')
     map = file['map']
     objects = file['objects']
     player = objects[file['player_index']]
@@ -1600,22 +2928,95 @@ def load_game():    #load the save file (last game)
     game_msgs = file['game_msgs']
     game_state = file['game_state']
     stairs = objects[file['stairs_index']]
+    upstairs = None
+    reset_level_store()
     dungeon_level = file['dungeon_level']
+    global_timer = file['global_timer']
+    #restart the player's hunger where it was left
+    timer_queue = TimerQueue()
+    player.hunger.start(file['hunger_left'])
     file.close()
+    finish_loading()
     
+def finish_loading():   #rebuilds everything that isn't saved, after loading a game
+    journal_restructure()   #the journal only fits the objects from before loading
+    #the inventory is saved apart from the player, so its equipment is hooked back up to them
+    player.fighter.slots = {}
+    for obj in inventory:
+        if obj.equipment and obj.equipment.is_equipped:
+            obj.equipment.wearer = player
+            player.fighter.slots[obj.equipment.slot] = obj.equipment
+    player.fighter.equipment_changed()
+    settle_level()
     initialize_fov()
     
+def settle_level():     #rebuilds the indexes over a level's objects, after it was loaded or came out of the level store
+    global scent_map, master_objects, master_monsters
+    rebuild_object_grid()
+    #the lists drawn at death hold whatever is left on the level
+    master_objects = [obj for obj in objects if obj.item]
+    master_monsters = [obj for obj in objects if obj.ai]
+    count_alert_users()
+    settle_monsters()
+    scent_map = ScentMap()      #the old trail isn't saved
+    
 def next_level():   #advances to the next dungeon level
-    global dungeon_level
-
-    #advance to the next level
-    message('You take a moment to rest, and recover your strength', libtcod.light_violet)
-    level_up_heal()    #heal the player
+    if dungeon_level + 1 in level_store:
+        message('You descend the stairs to dungeon level ' + str(dungeon_level + 1) + ' again.', libtcod.gray)
+    else:
+        #advance to the next level
+        message('You take a moment to rest, and recover your strength', libtcod.light_violet)
+        level_up_heal()    #heal the player
+        
+        message('After a rare moment of peace, you descend deeper into the heart of the dungeon...', libtcod.gray)
+    change_level(dungeon_level + 1)
+    
+def previous_level():   #climbs back up to the level above
+    message('You climb back up the stairs to dungeon level ' + str(dungeon_level - 1) + '.', libtcod.gray)
+    change_level(dungeon_level - 1)
     
-    message('After a rare moment of peace, you descend deeper into the heart of the dungeon...', libtcod.gray)
-    dungeon_level += 1
-    make_map()  #create a fresh level
+def change_level(new_level):    #leaves this level for new_level, which is made fresh if the player has never been there
+    global dungeon_level
+    leave_level()
+    going_down = new_level > dungeon_level
+    dungeon_level = new_level
+    player.dungeon_level = dungeon_level
+    if dungeon_level in level_store:
+        level = level_store.take(dungeon_level)
+        #the player comes out at the other end of the stairs they took
+        if going_down:
+            enter_level(level, level.upstairs.x, level.upstairs.y)
+        else:
+            enter_level(level, level.stairs.x, level.stairs.y)
+    else:
+        make_map()  #create a fresh level
+    level_store.settle(dungeon_level)
     initialize_fov()
+    
+def leave_level():  #takes the level the player is on out of play and into the level store
+    level_objects = [obj for obj in objects if obj is not player]
+    level = Level(map, level_objects, stairs, upstairs, timer_table(level_objects), global_timer)
+    for obj in level_objects:    #the old level's monsters stop ticking once we leave it
+        timer_queue.cancel_all(obj)
+    level_store.put(dungeon_level, level)
+    
+def enter_level(level, x, y):   #puts a level from the level store back in play, with the player at (x, y)
+    global map, objects, stairs, upstairs
+    journal_restructure()   #a different level can't be described as changes to this one
+    map = level.map
+    objects = level.objects + [player]  #the timer table counts on the level's objects keeping their places
+    stairs = level.stairs
+    upstairs = level.upstairs
+    (player.x, player.y) = (x, y)
+    settle_level()
+    #a monster may have wandered onto the stairs before the player left, so it steps aside to make room
+    for obj in list(objects_at(x, y)):
+        if obj.blocks and obj is not player:
+            for (dx, dy) in NEIGHBORS:
+                if not is_blocked(x + dx, y + dy):
+                    grid_move(obj, x + dx, y + dy)
+                    break
+    restore_timers(level.timers, global_timer - level.left_at)
         
 
 #XXXXXXXXXXXXXXXXXXX
@@ -1627,15 +3028,51 @@ libtcod.console_set_custom_font ('arial10x10.png', libtcod.FONT_TYPE_GREYSCALE |
 
 #initializes console
 libtcod.console_init_root (SCREEN_WIDTH, SCREEN_HEIGHT, 'firstrouge', False)
-con = libtcod.console_new(MAP_WIDTH, MAP_HEIGHT)    #canvas, draws to console
+con = libtcod.console_new(CAMERA_WIDTH, CAMERA_HEIGHT)  #canvas, draws to console. Only ever holds what the camera sees
 panel = libtcod.console_new(SCREEN_WIDTH, PANEL_HEIGHT) #GUI panel
 
 #sets framerate
 libtcod.sys_set_fps(LIMIT_FPS)
 
+#torch light tables, built on the first frame
+light_key = None
+
+#dirty-region rendering: what needs redrawing on the next frame
+redraw_map = True
+redraw_messages = True
+dirty_tiles = set()
+panel_rows = {}     #the values last drawn in each panel row, so unchanged rows can be skipped
+
+#cached distance fields, keyed by goal tile, least recently used first
+distance_fields = OrderedDict()
+player_field = None
+path_pool = []
+monster_paths = {}
+
+#autosave journal
+journal_file = None
+journal_pending = []
+journal_serial = 0
+save_thread = None
+save_error = None
+save_size = 0       #how big the last save file written is
+journal_ids = {}
+journal_objects = set()
+journal_written = {}
+journal_tiles = []
+journal_compact = True
+journal_bytes = 0
+
+#the levels the player has left
+level_store = None
+upstairs = None
+
 
 #XXXXXXXXXXXXXX
 #   Main Loop
 #XXXXXXXXXXXXXX
 
-main_menu()
+if '--benchmark-save' in sys.argv:
+    benchmark_save()
+else:
+    main_menu()